@@ -1,264 +1,207 @@
 import streamlit as st
-import pandas as pd
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-import io
-import base64
-import glob
 import os
-import random
-import streamlit.components.v1 as components
-from streamlit_pdf_viewer import pdf_viewer
+import json
+import hashlib
+import tempfile
+from wordtest.wordbook import wordbook_cache, WordBookError
+from wordtest.questions import STRATIFY_MODES, QuestionEngine, new_test_seed, select_questions, select_review, shared_test_seed
+from wordtest.ranges import parse_ranges, RangeError
+from wordtest.pool import pool_for
+from wordtest.plan import build_plan
+from wordtest import resources, timing
+from wordtest.jobs import render_jobs
+from wordtest.sessioncache import SessionCache
+from wordtest.delivery import publish_pdf, open_published_tmp, publish_file, published_url, local_path
+from wordtest.pdfcache import pdf_cache, pdf_cache_key
+from wordtest.results import default_store, review_priority
+from wordtest.manifest import build_manifest, qr_codes, save_manifest
 
 # --- 設定 ---
+# ReportLab・PDF ビューアは PDF を作るときに resources 経由で読み込む（起動を速くするため）
 st.set_page_config(page_title="単語テストアプリ", layout="wide")
 DATA_DIR = "単語data"
-
-# --- フォント設定 ---
-try:
-    pdfmetrics.registerFont(UnicodeCIDFont('HeiseiMin-W3'))
-    JP_FONT_NAME = 'HeiseiMin-W3' # 明朝体
-    
-    pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
-    JP_FONT_GOTHIC = 'HeiseiKakuGo-W5' # ゴシック体
-except:
-    JP_FONT_NAME = 'Helvetica'
-    JP_FONT_GOTHIC = 'Helvetica-Bold'
-
-EN_FONT_NAME = 'Times-Roman'
+# 処理時間の内訳: WORDTEST_TIMING_LOG で JSON を記録、WORDTEST_DEBUG=1 でサイドバーに表示
+# （WORDTEST_DEBUG=query なら ?debug=1 をつけたときだけ表示。プロファイルをサーバーに書くので既定では開かない）
+DEBUG_MODE = os.environ.get("WORDTEST_DEBUG")
+DEBUG = DEBUG_MODE == "1" or (DEBUG_MODE == "query" and st.query_params.get("debug") == "1")
+timer = timing.start("rerun")
+FIRST_WAIT = 0.5  # 作成直後、進捗表示に切り替えるまで描画ジョブを待つ秒数
 
 # --- ユーティリティ関数 ---
-def guess_pos(text):
-    text = str(text).strip()
-    if "～" in text or text.endswith("する") or text.endswith("る"):
-        return "verb_like"
-    elif text.endswith("い") or text.endswith("な") or text.endswith("の"):
-        return "adj_like"
-    elif text.endswith("に") and len(text) > 1:
-        return "adv_like"
-    else:
-        return "noun_like"
-
-def draw_text_fitted(c, text, x, y, max_width, font_name, max_size, min_size=6):
-    """枠に合わせて文字サイズを自動縮小して描画（日本語混じり自動対応版）"""
-    text = str(text)
-    
-    if font_name == EN_FONT_NAME:
-        if any(ord(char) > 127 for char in text):
-            font_name = JP_FONT_NAME 
-
-    current_size = max_size
-    try:
-        text_width = c.stringWidth(text, font_name, current_size)
-        if text_width > max_width:
-            ratio = max_width / text_width
-            new_size = current_size * ratio
-            if new_size < min_size:
-                new_size = min_size
-            current_size = new_size
-    except:
-        pass
-    c.setFont(font_name, current_size)
-    c.drawString(x, y, text)
-
 def get_csv_files():
-    if not os.path.exists(DATA_DIR):
-        return []
-    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
-    return files
+    return wordbook_cache.list_files(DATA_DIR)
 
 def load_data(filepath):
     try:
-        df = pd.read_csv(filepath)
-        required_cols = {'id', 'english', 'japanese'}
-        if not required_cols.issubset(df.columns):
-            st.error(f"エラー: {os.path.basename(filepath)} に必要な列が含まれていません。")
-            return None
-        return df
+        return wordbook_cache.get(filepath)
+    except WordBookError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"読み込みエラー: {e}")
         return None
 
-# --- PDF作成関数 ---
-def create_pdf(target_data, all_data_df, title, test_type, include_answers=False):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    
-    GRAY_BG = (0.96, 0.96, 0.96)
-    
-    pos_groups = {"verb_like": [], "adj_like": [], "noun_like": [], "adv_like": []}
-    unique_meanings = all_data_df['japanese'].dropna().unique().tolist()
-    for m in unique_meanings:
-        pos_groups[guess_pos(m)].append(m)
-
-    # レイアウト設定
-    margin_x = 5 * mm
-    margin_y = 15 * mm
-    col_gap = 6 * mm
-    cols = 2
-    
-    if test_type == "記述式":
-        rows_per_col = 25
+def render_pdfs(source, plan, sheets, codes=None, progress=None):
+    """sheets: [(タイトル, 解答を書くか), ...]。PDFキャッシュにないものだけまとめて描画する"""
+    keys = [pdf_cache_key(source.content_hash, plan, title, include_answers) for title, include_answers in sheets]
+    results = [pdf_cache.get(key) for key in keys]
+    missing = [i for i, data in enumerate(results) if data is None]
+    if missing:
+        rendered = resources.renderer().render_sheets(plan, [sheets[i] for i in missing], progress=progress, **(codes or {}))
+        for i, buffer in zip(missing, rendered):
+            results[i] = buffer.getvalue()
+            pdf_cache.put(keys[i], results[i])
+    return results
+
+def show_debug_panel(timer):
+    """今回の実行の処理時間の内訳と、プロファイルの結果をサイドバーに出す"""
+    with st.sidebar.expander("🛠 デバッグ", expanded=False):
+        st.caption(f"request {timer.request_id}: {timer.total:.1f} ms")
+        st.caption(f"単語帳キャッシュ: {wordbook_cache.stats()}")
+        st.caption(f"PDF キャッシュ: {pdf_cache.stats()}")
+        st.caption(f"描画ジョブ: {render_jobs.stats()}")
+        st.caption(f"セッションのテスト: {session_tests().stats()}")
+        if "render_job" in timer.fields:
+            st.caption(f"描画ジョブの待ち・実行 (ms): {timer.fields['render_job']}")
+        st.dataframe([{"処理": "　" * s["depth"] + s["name"], "ms": round(s.get("ms", 0.0), 1)} for s in timer.spans],
+                     hide_index=True)
+        profile = st.session_state.get("last_profile")
+        if profile:
+            st.text(profile["stats"])
+            with open(profile["path"], "rb") as f:
+                st.download_button("プロファイル（.prof）", f.read(), file_name=os.path.basename(profile["path"]))
+        st.checkbox("次の「作成」を cProfile で記録", key="debug_profile_next")
+
+def publish_large(source, plan, sheets, codes=None, progress=None):
+    """大きなテスト用: 一時ファイルに直接描画して配信し、URL のリストを返す（配信済みなら描き直さない）"""
+    keys = [pdf_cache_key(source.content_hash, plan, title, include_answers) for title, include_answers in sheets]
+    urls = [published_url(key) for key in keys]
+    missing = [i for i, url in enumerate(urls) if url is None]
+    if missing:
+        files = [open_published_tmp() for _ in missing]
+        try:
+            resources.renderer().render_sheets(plan, [sheets[i] for i in missing], outputs=[f for f, _ in files],
+                                               progress=progress, **(codes or {}))
+        except Exception:
+            for f, tmp_path in files:
+                f.close()
+                os.remove(tmp_path)
+            raise
+        for f, _ in files:
+            f.close()
+        for i, (_, tmp_path) in zip(missing, files):
+            urls[i] = publish_file(tmp_path, key=keys[i])
+    return urls
+
+def submit_render(source, plan, sheets, codes, streamed, total_pages, inline=False):
+    """PDF の描画をジョブとして投げる（同じ PDF を作る設定なら実行中・完了済みのジョブを返す）
+
+    inline=True ならこのスレッドで描画する（cProfile で描画まで記録するため）。
+    """
+    keys = [pdf_cache_key(source.content_hash, plan, title, include_answers) for title, include_answers in sheets]
+    job_id = hashlib.sha256(json.dumps([keys, streamed]).encode("utf-8")).hexdigest()[:16]
+    if streamed:
+        # 大きなテストは PDF 全体をメモリに持たず、配信フォルダのファイルに直接書き出す
+        return render_jobs.submit(job_id, lambda progress: publish_large(source, plan, sheets, codes, progress), total_pages, inline)
+    return render_jobs.submit(job_id, lambda progress: render_pdfs(source, plan, sheets, codes, progress), total_pages, inline)
+
+def zip_published(files):
+    """{ファイル名: 配信 URL} を一時ファイルの ZIP にまとめ、先頭に戻したファイルを返す"""
+    zip_file = tempfile.TemporaryFile(buffering=0)  # st.download_button が読める生のファイル
+    resources.renderer().zip_pdf_files({name: local_path(url) for name, url in files.items()}, zip_file)
+    zip_file.seek(0)
+    return zip_file
+
+def render_preview(source, plan, title, include_answers, codes=None):
+    """先頭 PREVIEW_PAGES ページだけの PDF を作る（キャッシュあり）"""
+    render = resources.renderer()
+    pages = list(range(min(render.PREVIEW_PAGES, render.count_pages(plan))))
+    key = pdf_cache_key(source.content_hash, plan, title, include_answers, pages=pages)
+    return pdf_cache.get_or_render(key, lambda: render.render_pages(plan, title, include_answers, pages, **(codes or {})).getvalue())
+
+def session_tests():
+    """このセッションで作ったテストの LRU（出題・TestPlan・PDF）"""
+    return st.session_state.setdefault("test_cache", SessionCache())
+
+def output_size(output):
+    """セッションの LRU に数える大きさ（メモリに持つ PDF の分。配信ファイルの URL は数えない）"""
+    size = len(output["preview"] or b"")
+    if not output["streamed"]:
+        size += sum(len(data) for data in output["result"])
+    return size
+
+@st.fragment(run_every=0.5)
+def wait_for_render(job):
+    """描画中はこの部分だけを定期的に再実行して進捗を出す（その間もサイドバーは操作できる）"""
+    if job.finished:
+        st.rerun()  # 画面全体を描き直して結果を出す
+    st.progress(job.progress, text=f"PDF を作成中… {job.pages_done}/{job.total_pages}ページ")
+
+def show_output(output):
+    """作成ボタンで投げた描画ジョブの進み具合、終わっていれば結果を表示する
+
+    描き終えた結果は output に入れてセッションの LRU に残す（次からはジョブを見ない）。
+    """
+    if output["result"] is None:
+        job = render_jobs.get(output["job_id"])
+        if job is None:
+            st.warning("作成結果が見つかりません。もう一度「作成」を押してください。")
+            return
+        # すぐ終わる小さなテストは、進捗を出さずにそのまま結果を表示する
+        with timing.span("render.wait"):
+            finished = job.wait(FIRST_WAIT)
+        if not finished:
+            wait_for_render(job)
+            return
+        # ジョブが自分のタイマーに記録した描画の内訳を、結果を受け取ったこの実行のタイマーに写す
+        request_timer = timing.current()
+        request_timer.fields["render_job"] = job.timings()
+        if job.timer is not None:
+            request_timer.merge("render.job", job.timer, queued_ms=job.timings()["queued_ms"])
+        if job.status == "error":
+            st.error(f"PDF の作成に失敗しました: {job.error}")
+            return
+        output["result"] = job.result
+        session_tests().put(output["key"], output, output_size(output))
+
+    render = resources.renderer()
+    pdf_viewer = resources.pdf_viewer()
+    source, plan, sheets, manifest = output["source"], output["plan"], output["sheets"], output["manifest"]
+    title_input, total_pages, streamed = output["title"], output["total_pages"], output["streamed"]
+    if streamed:
+        pdf_urls = output["result"]
     else:
-        rows_per_col = 10
-        
-    items_per_page = cols * rows_per_col
-    header_height = 35 * mm
-    body_height = height - (2 * margin_y) - header_height
-    row_height = body_height / rows_per_col
-    col_width = (width - (2 * margin_x) - col_gap) / 2
-
-    total_pages = (len(target_data) + items_per_page - 1) // items_per_page
-
-    for page in range(total_pages):
-        # ヘッダー
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont(JP_FONT_GOTHIC, 18)
-        c.drawCentredString(width / 2, height - margin_y - 8*mm, title)
-        
-        line_y = height - margin_y - 12*mm
-        c.setLineWidth(1.0)
-        c.line(margin_x, line_y, width - margin_x, line_y)
-        c.setLineWidth(0.3)
-        c.line(margin_x, line_y - 1*mm, width - margin_x, line_y - 1*mm)
-
-        c.setFont(JP_FONT_NAME, 10)
-        info_y = height - margin_y - 22*mm
-        c.drawRightString(width - margin_x - 50*mm, info_y, "日付: ______ / ______   氏名: ______________________")
-        
-        score_box_w = 40 * mm
-        score_box_h = 14 * mm
-        score_box_x = width - margin_x - score_box_w
-        score_box_y = height - margin_y - 28*mm
-        
-        c.setLineWidth(1.2)
-        c.rect(score_box_x, score_box_y, score_box_w, score_box_h)
-        c.setFont(JP_FONT_GOTHIC, 11)
-        c.drawString(score_box_x + 2*mm, score_box_y + score_box_h - 5*mm, "SCORE")
-        c.setFont(EN_FONT_NAME, 16)
-        c.drawRightString(score_box_x + score_box_w - 5*mm, score_box_y + 3*mm, "/       ")
-
-        c.setFont(EN_FONT_NAME, 9)
-        c.drawRightString(width - margin_x, 8 * mm, f"- {page + 1} -")
-
-        # 問題描画
-        start_y = height - margin_y - header_height
-        page_data = target_data[page * items_per_page : (page + 1) * items_per_page]
-        
-        c.setLineWidth(0.3) 
-
-        for i, item in enumerate(page_data):
-            col_idx = i // rows_per_col
-            row_idx = i % rows_per_col
-            
-            x_base = margin_x + col_idx * (col_width + col_gap)
-            y_base = start_y - row_idx * row_height
-            text_y = y_base - row_height + (row_height / 2)
-
-            if row_idx % 2 == 0:
-                c.setFillColorRGB(*GRAY_BG)
-                c.rect(x_base, y_base - row_height, col_width, row_height, fill=1, stroke=0)
-                c.setFillColorRGB(0, 0, 0)
-
-            if test_type == "記述式":
-                w_id = col_width * 0.10
-                w_word = col_width * 0.45
-                w_ans = col_width * 0.45
-                
-                c.setDash(1, 2)
-                c.setStrokeColorRGB(0.5, 0.5, 0.5)
-                c.line(x_base, y_base - row_height, x_base + col_width, y_base - row_height)
-                c.setDash([])
-                c.setStrokeColorRGB(0, 0, 0)
-
-                c.setFont(JP_FONT_GOTHIC, 9)
-                c.drawCentredString(x_base + (w_id / 2), text_y - 2, str(item['id']))
-                
-                c.setLineWidth(0.3)
-                c.line(x_base + w_id, y_base, x_base + w_id, y_base - row_height)
-                
-                draw_text_fitted(c, str(item['english']), x_base + w_id + 2*mm, text_y - 2, w_word - 4*mm, EN_FONT_NAME, 11)
-                
-                c.line(x_base + w_id + w_word, y_base, x_base + w_id + w_word, y_base - row_height)
-                if include_answers:
-                    draw_text_fitted(c, str(item['japanese']), x_base + w_id + w_word + 2*mm, text_y - 2, w_ans - 4*mm, JP_FONT_NAME, 9)
-
-            else:
-                c.setLineWidth(0.3)
-                c.setStrokeColorRGB(0, 0, 0)
-                c.rect(x_base, y_base - row_height, col_width, row_height)
-                
-                correct_ans = item['japanese']
-                target_pos = guess_pos(correct_ans)
-                candidates = [cand for cand in pos_groups.get(target_pos, []) if cand != correct_ans]
-                
-                if len(candidates) < 3:
-                    fallback = [m for m in unique_meanings if m != correct_ans]
-                    distractors = random.sample(fallback, 3)
-                else:
-                    random.seed(item['id'])
-                    distractors = random.sample(candidates, 3)
-
-                choices = distractors + [correct_ans]
-                random.seed(item['id'] + 10000)
-                random.shuffle(choices)
-                
-                correct_num = choices.index(correct_ans) + 1
-
-                line_1_y = y_base - 13
-                line_2_y = y_base - 32
-                line_3_y = y_base - 48
-                
-                c.setFont(JP_FONT_GOTHIC, 11)
-                id_str = f"{item['id']}."
-                c.drawString(x_base + 3*mm, line_1_y, id_str)
-                id_width = c.stringWidth(id_str, JP_FONT_GOTHIC, 11)
-                
-                max_word_width = col_width - 25*mm - id_width 
-                
-                draw_text_fitted(c, str(item['english']), x_base + 4*mm + id_width, line_1_y, max_word_width, EN_FONT_NAME, 13)
-                
-                c.setFont(EN_FONT_NAME, 12)
-                c.drawRightString(x_base + col_width - 5*mm, line_1_y, "(       )")
-                
-                if include_answers:
-                    c.setFont(JP_FONT_GOTHIC, 11)
-                    c.drawCentredString(x_base + col_width - 10*mm, line_1_y, str(correct_num))
-                
-                c.setFont(JP_FONT_NAME, 9)
-                c.setFillColorRGB(0, 0, 0)
-                
-                def draw_choice(idx, txt, cx, cy):
-                    label = f"{idx}. {txt}"
-                    if len(label) > 18: label = label[:17] + ".."
-                    c.drawString(cx, cy, label)
-
-                draw_choice(1, choices[0], x_base + 5*mm, line_2_y)
-                draw_choice(2, choices[1], x_base + (col_width/2) + 2*mm, line_2_y)
-                draw_choice(3, choices[2], x_base + 5*mm, line_3_y)
-                draw_choice(4, choices[3], x_base + (col_width/2) + 2*mm, line_3_y)
-
-        if page_data:
-            c.setLineWidth(1.0)
-            c.setStrokeColorRGB(0, 0, 0)
-            items_in_col1 = min(rows_per_col, len(page_data))
-            h_col1 = items_in_col1 * row_height
-            c.rect(margin_x, start_y - h_col1, col_width, h_col1)
-            
-            if len(page_data) > rows_per_col:
-                items_in_col2 = len(page_data) - rows_per_col
-                h_col2 = items_in_col2 * row_height
-                c.rect(margin_x + col_width + col_gap, start_y - h_col2, col_width, h_col2)
-
-        c.showPage()
-
-    c.save()
-    buffer.seek(0)
-    return buffer
+        pdf_data = output["result"]
+
+    st.success(f"✅ 作成完了！プレビューは印刷ボタンを押して確認してね！")
+    if output["mode"] == "両方":
+        names = [f"{title}.pdf" for title, _ in sheets]
+        if streamed:
+            # ZIP はボタンが押されたときに配信済みの PDF から作る
+            zip_file = lambda: zip_published(dict(zip(names, pdf_urls)))
+        else:
+            zip_file = render.zip_pdfs(dict(zip(names, pdf_data)))
+        st.download_button("📦 問題用紙＋模範解答（ZIP）", zip_file, file_name=f"{title_input}.zip", mime="application/zip")
+    st.download_button("🔑 解答マニフェスト（JSON）", json.dumps(manifest, ensure_ascii=False),
+                       file_name=f"{manifest['test_id']}.json", mime="application/json")
+    st.caption(f"テストID: {manifest['test_id']}（python -m wordtest.grade で採点できます）")
+    # PDF はハッシュ名で静的配信し、印刷ボタンはその URL を新しいタブで開くだけにする
+    with timing.span("publish"):
+        pdf_url = pdf_urls[0] if streamed else publish_pdf(pdf_data[0])
+    st.link_button("🖨️ 印刷", pdf_url, type="primary")
+    st.markdown("### 📄 プレビュー")
+    if total_pages > render.PREVIEW_MAX_PAGES:
+        # 大きなテストは先頭ページだけ描いて送る（全体は印刷ボタンで開く PDF に入っている）
+        st.caption(f"最初の{render.PREVIEW_PAGES}ページのみ表示しています（全{total_pages}ページ）。")
+        if output["preview"] is None:
+            with timing.span("preview"):
+                output["preview"] = render_preview(source, plan, *sheets[0], codes=output["codes"])
+            session_tests().put(output["key"], output, output_size(output))
+        preview = output["preview"]
+    else:
+        preview = pdf_data[0]
+    with timing.span("pdf_viewer"):
+        pdf_viewer(input=preview, width=800)
 
 # --- アプリ画面 ---
 st.title("🖨️ 単語テストアプリ")
@@ -272,12 +215,15 @@ else:
     files_map = {os.path.basename(p): p for p in csv_files_paths}
     selected_filename = st.sidebar.selectbox("ファイルを選択", list(files_map.keys()))
     selected_filepath = files_map[selected_filename]
+    timer.fields["file"] = selected_filename
     
-    df = load_data(selected_filepath)
+    with timing.span("load_data"):
+        book = load_data(selected_filepath)
 
-    if df is not None:
-        min_id = int(df['id'].min())
-        max_id = int(df['id'].max())
+    if book is not None:
+        resources.warm_in_background(book)
+        min_id = int(book.id_index.ids[0])
+        max_id = int(book.id_index.ids[-1])
         st.sidebar.caption(f"収録範囲: No.{min_id} ～ No.{max_id}")
         st.sidebar.subheader("出題範囲")
         st.sidebar.caption(f"*通し番号で入力してください")
@@ -288,18 +234,63 @@ else:
             end_id_default = min(min_id+49, max_id)
             end_id = st.number_input("終了ID", min_value=min_id, max_value=max_id, value=end_id_default)
         
-        # 選択された範囲内の実際のデータ数を計算
-        temp_target_df = df[(df['id'] >= start_id) & (df['id'] <= end_id)]
-        max_questions = len(temp_target_df)
+        ranges_text = st.sidebar.text_input("複数範囲（任意）", placeholder="例: 1-50, 201-250")
+        ranges = [(start_id, end_id)]
+        if ranges_text.strip():
+            try:
+                ranges = parse_ranges(ranges_text)
+            except RangeError as e:
+                st.sidebar.error(str(e))
+        
+        # 他の単語帳も混ぜる場合は、単語帳ごとに範囲を指定する（空欄なら全範囲）
+        extra_names = st.sidebar.multiselect("組み合わせる単語帳（任意）", [n for n in files_map if n != selected_filename])
+        book_ranges = [(book, ranges)]
+        for name in extra_names:
+            with timing.span("load_data"):
+                extra_book = load_data(files_map[name])
+            if extra_book is None:
+                continue
+            extra_text = st.sidebar.text_input(f"{name} の範囲", placeholder="空欄で全範囲", key=f"ranges_{name}")
+            extra_ranges = [(int(extra_book.id_index.ids[0]), int(extra_book.id_index.ids[-1]))] if len(extra_book) else []
+            if extra_text.strip():
+                try:
+                    extra_ranges = parse_ranges(extra_text)
+                except RangeError as e:
+                    st.sidebar.error(str(e))
+            book_ranges.append((extra_book, extra_ranges))
+
+        # 誤答索引は単語帳を足した分だけ追加するので、プールはセッションに取っておく
+        source = book
+        if len(book_ranges) > 1:
+            source = pool_for(st.session_state.get("word_pool"), [b for b, _ in book_ranges])
+            st.session_state["word_pool"] = source
+
+        # 選択された範囲内の実際のデータ数を計算（ID順の索引を二分探索するだけ）
+        with timing.span("count"):
+            range_count = book.id_index.count(ranges) if source is book else source.count(book_ranges)
+        max_questions = range_count
         if max_questions == 0: 
             max_questions = 1 # エラー回避用
             
-        st.sidebar.caption(f"選択範囲内の単語数: {len(temp_target_df)}語")
+        st.sidebar.caption(f"選択範囲内の単語数: {range_count}語")
         num_questions = st.sidebar.number_input("出題数", min_value=1, max_value=max_questions, value=max_questions)
+        # 範囲の一部だけを出すときに、品詞や範囲内の位置（ID帯）が偏らないよう層ごとに割り振る
+        stratify = st.sidebar.selectbox("抽出の偏りをなくす", ["しない", *STRATIFY_MODES])
+        stratify = None if stratify == "しない" else stratify
+
+        # 生徒・クラスを指定すると、記録した結果から復習が必要な単語を優先して出題できる
+        learner = st.sidebar.text_input("生徒・クラス（任意）", placeholder="結果の記録・復習優先に使います").strip()
+        pick_mode = "ランダム"
+        if learner:
+            pick_mode = st.sidebar.radio("出題の選び方", ["ランダム", "復習優先"], horizontal=True)
         
         st.sidebar.markdown("---")
         st.sidebar.header("2. テスト形式")
         test_type = st.sidebar.selectbox("出題形式", ["4択式", "記述式"])
+        choice_mode = None
+        if test_type == "4択式":
+            # 似た訳語: 同じ品詞のうち、訳語の文字の並び（と英語のつづり）が似ているものから誤答を選ぶ
+            choice_mode = st.sidebar.radio("誤答の選び方", ["同じ品詞", "似た訳語"], horizontal=True)
         
         default_title = f"{os.path.splitext(selected_filename)[0]} テスト"
         title_input = st.sidebar.text_input("タイトル", value=default_title)
@@ -307,82 +298,127 @@ else:
         order_mode = st.sidebar.radio("出題順序", ["順番通り", "ランダム"], horizontal=True)
         
         st.sidebar.markdown("---")
-        mode = st.sidebar.radio("出力モード", ["問題用紙", "模範解答"], horizontal=True)
+        mode = st.sidebar.radio("出力モード", ["問題用紙", "模範解答", "両方"], horizontal=True)
         
+        profile = None
         if st.sidebar.button("作成", type="primary"):
+            timer.name = "create"
+            if DEBUG and st.session_state.get("debug_profile_next"):
+                # このリクエストだけ cProfile を動かす（結果はデバッグ欄に出る）
+                st.session_state["debug_profile_next"] = False
+                profile = timing.ProfileCapture().start()
             # --- 修正箇所：設定条件が変わった場合のみ再生成するロジック ---
             current_params = {
                 "filename": selected_filename,
-                "start_id": start_id,
-                "end_id": end_id,
+                "books": [(b.key, r) for b, r in book_ranges],
                 "num_questions": num_questions,
-                "order_mode": order_mode
+                "order_mode": order_mode,
+                "learner": learner,
+                "pick_mode": pick_mode,
+                "stratify": stratify,
             }
 
-            # キャッシュが存在しない、または設定条件(出力モード以外)が変わった場合にデータを再生成
-            if "last_generated_df" not in st.session_state or st.session_state.get("last_params") != current_params:
-                target_df = df[(df['id'] >= start_id) & (df['id'] <= end_id)]
+            # 作ったテストはセッションの LRU に残し、同じ設定に戻したら同じ出題・同じ PDF を出す
+            tests = session_tests()
+            sample_key = ("sample", json.dumps(current_params, ensure_ascii=False))
+            sample = tests.get(sample_key)
+            if sample is None:
+                if num_questions >= range_count and order_mode == "順番通り":
+                    # 範囲の全部を ID 順に出すなら出題は乱数によらないので、シードも条件から決めて
+                    # 他のセッションと同じテストにする（よく使う範囲の PDF をキャッシュで使い回せる）
+                    seed = shared_test_seed(source.content_hash, current_params)
+                else:
+                    seed = new_test_seed()
+                with timing.span("select"):
+                    candidates = book.id_index.select(ranges) if source is book else source.select(book_ranges)
+                    if pick_mode == "復習優先":
+                        # 期限切れ → 未出題 → 期限前の順に選ぶ（範囲内の復習状態だけを索引で引く）
+                        store = default_store()
+                        schedules = {b.key: store.schedule(learner, b.key, r) for b, r in book_ranges}
+                        ranked = review_priority(candidates, schedules, book.key)
+                        target_df = select_review(ranked, num_questions, order_mode, seed)
+                    else:
+                        target_df = select_questions(candidates, num_questions, order_mode, seed, stratify)
                 
-                if len(target_df) > 0 and start_id <= end_id:
-                    if num_questions < len(target_df):
-                        # 範囲内から指定数だけランダムに抽出
-                        target_df = target_df.sample(n=num_questions)
-                    
-                    if order_mode == "ランダム":
-                        target_df = target_df.sample(frac=1) # 最終的な並び順をランダムに
+                if len(target_df) > 0:
+                    # 選択肢・正解番号（TestPlan）は (出題形式, 誤答の選び方) ごとに一度だけ決め、plans に足していく
+                    sample = {"df": target_df, "seed": seed, "source": source, "plans": {}}
+                    # TestPlan（形式・誤答の選び方ごと）も同じくらいの大きさになるので、その分も見込む
+                    tests.put(sample_key, sample, 3 * int(target_df.memory_usage(deep=True).sum()))
+
+            if sample is not None:
+                # 採点結果の記録欄で使う
+                st.session_state["last_generated_df"] = sample["df"]
+                st.session_state["last_params"] = current_params
+                st.session_state["last_source"] = sample["source"]
+                with timing.span("import"):
+                    render = resources.renderer()
+                source = sample["source"]
+                plan = sample["plans"].get((test_type, choice_mode))
+                if plan is None:
+                    with timing.span("build_plan"):
+                        similar = source.similar if choice_mode == "似た訳語" else None
+                        engine = QuestionEngine(source.distractors, source.key, sample["seed"], similar)
+                        plan = build_plan(sample["df"], engine, test_type)
+                    sample["plans"][(test_type, choice_mode)] = plan
+
+                output_key = sample_key + (test_type, choice_mode, mode, title_input)
+                output = tests.get(output_key)
+                if output is not None and output["streamed"] and not all(os.path.exists(local_path(url)) for url in output["result"]):
+                    output = None  # 配信フォルダから消えていたら描き直す
+                if output is None:
+                    if mode == "両方":
+                        # 問題用紙と模範解答を一度に作り、ZIP でまとめてダウンロードできるようにする
+                        sheets = [(title_input, False), (title_input + "【解答】", True)]
                     else:
-                        target_df = target_df.sort_values('id') # ID順に戻す
-                    
-                    # 生成したデータをセッションステートに保存
-                    st.session_state["last_generated_df"] = target_df
-                    st.session_state["last_params"] = current_params
-                else:
-                    st.session_state["last_generated_df"] = None
-            
-            # --- 保存されたデータを使用 ---
-            target_df = st.session_state.get("last_generated_df")
+                        include_answers = (mode == "模範解答")
+                        sheets = [(title_input + ("【解答】" if include_answers else ""), include_answers)]
+
+                    # 正解の一覧（マニフェスト）を保存し、テスト ID（模範解答は正解も）を QR コードでヘッダーに入れる
+                    with timing.span("manifest"):
+                        manifest = build_manifest(source.content_hash, plan, title_input, choice_mode)
+                        save_manifest(manifest)
+                        codes = qr_codes(manifest)
+
+                    total_pages = render.count_pages(plan)
+                    streamed = total_pages > render.STREAM_PAGES
+                    # 描画は共有のワーカーで行い、結果はセッションに残したジョブ ID で後から受け取る
+                    job = submit_render(source, plan, sheets, codes, streamed, total_pages, inline=profile is not None)
+                    output = {
+                        "key": output_key, "job_id": job.id, "source": source, "plan": plan, "sheets": sheets,
+                        "mode": mode, "title": title_input, "manifest": manifest, "codes": codes,
+                        "streamed": streamed, "total_pages": total_pages, "result": None, "preview": None,
+                    }
+                st.session_state["render_output"] = output
 
-            if target_df is not None and not target_df.empty:
-                include_answers = (mode == "模範解答")
-                final_title = title_input + ("【解答】" if include_answers else "")
-                
-                pdf_bytes = create_pdf(
-                    target_df.to_dict('records'), 
-                    df,
-                    final_title, 
-                    test_type, 
-                    include_answers=include_answers
-                )
-                
-                st.success(f"✅ 作成完了！プレビューは印刷ボタンを押して確認してね！")
-                pdf_b64 = base64.b64encode(pdf_bytes.getvalue()).decode('utf-8')
-                
-                js_code = f"""
-                <script>
-                    function openPdf() {{
-                        var binary = atob("{pdf_b64}");
-                        var array = [];
-                        for (var i = 0; i < binary.length; i++) {{
-                            array.push(binary.charCodeAt(i));
-                        }}
-                        var blob = new Blob([new Uint8Array(array)], {{type: 'application/pdf'}});
-                        var url = URL.createObjectURL(blob);
-                        window.open(url, '_blank');
-                    }}
-                </script>
-                <div style="text-align: center; margin: 20px 0;">
-                    <button onclick="openPdf()" style="
-                        background-color: #FF4B4B; color: white; border: none; padding: 12px 24px; 
-                        font-size: 18px; font-weight: bold; border-radius: 8px; cursor: pointer;
-                        box-shadow: 0 4px 6px rgba(0,0,0,0.1); transition: background-color 0.3s;
-                    ">
-                        🖨️ 印刷
-                    </button>
-                </div>
-                """
-                components.html(js_code, height=80)
-                st.markdown("### 📄 プレビュー")
-                pdf_viewer(input=pdf_bytes.getvalue(), width=800)
-                
             else:
+                st.session_state["last_generated_df"] = None
+                st.session_state.pop("render_output", None)
                 st.error("指定された範囲にデータがありません。")
+
+        output = st.session_state.get("render_output")
+        if output is not None:
+            show_output(output)
+
+        if profile is not None:
+            st.session_state["last_profile"] = {"stats": profile.stop(), "path": profile.path}
+
+        # --- 採点結果の記録 ---
+        last_df = st.session_state.get("last_generated_df")
+        last_learner = (st.session_state.get("last_params") or {}).get("learner")
+        if last_df is not None and last_learner:
+            with st.expander(f"📝 採点結果を記録（{last_learner}）"):
+                with st.form("record_results"):
+                    sheet = last_df[['id', 'english', 'japanese']].assign(正解=True)
+                    edited = st.data_editor(sheet, disabled=['id', 'english', 'japanese'], hide_index=True)
+                    if st.form_submit_button("記録する"):
+                        books = last_df['book'] if 'book' in last_df.columns else [st.session_state["last_source"].key] * len(last_df)
+                        count = default_store().record(last_learner, zip(books, edited['id'], edited['正解']))
+                        # 記録で復習の優先順位が変わるので、この生徒の「復習優先」の出題は作り直す
+                        session_tests().drop(lambda key: json.loads(key[1])["learner"] == last_learner
+                                             and json.loads(key[1])["pick_mode"] == "復習優先")
+                        st.success(f"{count}問の結果を記録しました。")
+
+timing.finish(timer)
+if DEBUG:
+    show_debug_panel(timer)
@@ -0,0 +1 @@
+"""単語テストアプリのコア処理（Streamlit の画面から独立した部分）"""
@@ -0,0 +1,173 @@
+"""画面を使わずにテスト PDF をまとめて作る
+
+    python -m wordtest.batch jobs.json --out out --workers 4
+
+jobs.json はジョブのリスト（または {"jobs": [...]}）。1 件の例:
+
+    {"book": "*.csv", "chunk": 50, "test_type": ["4択式", "記述式"],
+     "order_mode": "順番通り", "answers": true, "seed": 0}
+
+    book        単語data 内のファイル名（glob 可）
+    start, end  出題範囲（省略時は単語帳全体）
+    ranges      "1-50, 201-250" のような複数範囲（start/end/chunk の代わりに指定）
+    chunk       指定すると範囲をこの語数ごとに分けて 1 ジョブずつにする
+    test_type   "4択式" / "記述式" またはそのリスト
+    order_mode  "順番通り" / "ランダム"
+    count       出題数（省略時は範囲内すべて）
+    seed        テストのシード（同じなら同じ PDF になる）
+    answers     模範解答も作るか（既定 true）
+    distractors 4択の誤答の選び方 "同じ品詞"（既定）/ "似た訳語"（python -m wordtest.similar で前計算しておくと速い）
+    stratify    出題数が範囲より少ないときの層別抽出 "品詞" / "ID帯"（省略時はそのまま無作為）
+    variants    A/B/C 版のように何通り作るか（既定 1。ファイル名とタイトルに A, B, C... をつける）
+    same_questions  variants のとき全版で同じ問題を使う（並び順・選択肢の順だけ変える。既定 false）
+    title       タイトル（省略時は「<単語帳名> テスト」）
+
+PDF のヘッダーには QR コードを入れ、解答マニフェストを <out>/manifests に書き出す
+（python -m wordtest.grade で採点できる）。
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from wordtest.manifest import build_manifest, qr_codes, save_manifest
+from wordtest.plan import build_plan
+from wordtest.questions import QuestionEngine, select_variants, variant_seed
+from wordtest.ranges import parse_ranges
+from wordtest.render import count_pages, render_sheets
+from wordtest.wordbook import wordbook_cache
+
+DATA_DIR = "単語data"
+
+
+def expand_jobs(specs, data_dir=DATA_DIR):
+    """ジョブ指定を、1 PDF（+ 解答）ずつの具体的なジョブに展開する"""
+    jobs = []
+    for spec in specs:
+        paths = sorted(glob.glob(os.path.join(data_dir, spec["book"])))
+        if not paths:
+            raise ValueError(f"単語帳が見つかりません: {spec['book']}")
+        test_types = spec.get("test_type", "4択式")
+        if isinstance(test_types, str):
+            test_types = [test_types]
+        for path in paths:
+            ids = wordbook_cache.get(path).df['id']
+            start = int(spec.get("start", ids.min()))
+            end = int(spec.get("end", ids.max()))
+            chunk = spec.get("chunk")
+            if "ranges" in spec:
+                job_ranges = [parse_ranges(spec["ranges"])]
+            elif chunk:
+                job_ranges = [[(s, min(s + chunk - 1, end))] for s in range(start, end + 1, chunk)]
+            else:
+                job_ranges = [[(start, end)]]
+            for ranges in job_ranges:
+                for test_type in test_types:
+                    jobs.append({
+                        "path": path,
+                        "ranges": ranges,
+                        "test_type": test_type,
+                        "order_mode": spec.get("order_mode", "順番通り"),
+                        "count": spec.get("count"),
+                        "seed": int(spec.get("seed", 0)),
+                        "answers": spec.get("answers", True),
+                        "distractors": spec.get("distractors", "同じ品詞"),
+                        "stratify": spec.get("stratify"),
+                        "variants": int(spec.get("variants", 1)),
+                        "same_questions": spec.get("same_questions", False),
+                        "title": spec.get("title"),
+                    })
+    return jobs
+
+
+def job_name(job):
+    stem = os.path.splitext(os.path.basename(job["path"]))[0]
+    ranges = "+".join(f"{start}-{end}" for start, end in job["ranges"])
+    return f"{stem}_{ranges}_{job['test_type']}"
+
+
+def run_job(job, out_dir):
+    """ワーカープロセスで 1 ジョブ（variants 通り）を実行し、書き出したファイルと所要時間を返す"""
+    started = time.perf_counter()
+    book = wordbook_cache.get(job["path"])
+    count = job["count"] or len(book)
+    selected = select_variants(book.id_index.select(job["ranges"]), count, job["order_mode"], job["seed"],
+                               job["variants"], job["stratify"], job["same_questions"])
+    if selected[0].empty:
+        raise ValueError("指定された範囲にデータがありません。")
+
+    similar = book.similar if job["distractors"] == "似た訳語" else None
+    files, test_ids, pages = [], [], 0
+    for variant, target_df in enumerate(selected):
+        engine = QuestionEngine(book.distractors, book.key, variant_seed(job["seed"], variant), similar)
+        plan = build_plan(target_df, engine, job["test_type"])
+        label = chr(ord("A") + variant) if job["variants"] > 1 else ""
+        title = (job["title"] or f"{book.key} テスト") + (f"（{label}）" if label else "")
+        sheets = [(title, False)]
+        if job["answers"]:
+            sheets.append((title + "【解答】", True))
+
+        # 解答マニフェストは <out>/manifests に置く（python -m wordtest.grade --manifests で採点に使う）
+        manifest = build_manifest(book.content_hash, plan, title, job["distractors"])
+        save_manifest(manifest, os.path.join(out_dir, "manifests"))
+
+        name = job_name(job) + (f"_{label}" if label else "")
+        paths = [os.path.join(out_dir, name + ("_解答" if include_answers else "") + ".pdf")
+                 for _, include_answers in sheets]
+        # BytesIO を経由せず、出力ファイルに直接書き出す
+        outputs = [open(path, "wb") for path in paths]
+        try:
+            render_sheets(plan, sheets, outputs=outputs, **qr_codes(manifest))
+        finally:
+            for f in outputs:
+                f.close()
+        files.extend(paths)
+        test_ids.append(manifest["test_id"])
+        pages += count_pages(plan) * len(sheets)
+    return {"files": files, "test_id": " ".join(test_ids), "pages": pages, "seconds": time.perf_counter() - started}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spec", help="ジョブ指定の JSON ファイル")
+    parser.add_argument("--out", default="batch_output", help="PDF の出力先フォルダ")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    with open(args.spec, encoding="utf-8") as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = specs["jobs"]
+    jobs = expand_jobs(specs, args.data_dir)
+    os.makedirs(args.out, exist_ok=True)
+    print(f"{len(jobs)} ジョブを {args.workers} プロセスで実行します")
+
+    started = time.perf_counter()
+    done = pages = 0
+    failures = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_job, job, args.out): job for job in jobs}
+        for future in as_completed(futures):
+            name = job_name(futures[future])
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append((name, e))
+                print(f"  NG {name}: {e}", file=sys.stderr)
+                continue
+            done += 1
+            pages += result["pages"]
+            print(f"  OK {name}  ID {result['test_id']}  {result['pages']}ページ  {result['seconds']:.2f}秒")
+
+    elapsed = time.perf_counter() - started
+    print(f"\n完了 {done} / 失敗 {len(failures)}  {elapsed:.1f}秒  "
+          f"({done / elapsed:.1f} ジョブ/秒, {pages / elapsed:.1f} ページ/秒)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
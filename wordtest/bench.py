@@ -0,0 +1,242 @@
+"""単語帳の読み込みと PDF 作成のベンチマーク
+
+    python -m wordtest.bench                       # 単語data の全単語帳 + 合成 10k/100k 語
+    python -m wordtest.bench --sizes 10000 --repeat 1
+    python -m wordtest.bench --compare bench_results/old.json
+    python -m wordtest.bench --startup-only         # アプリの起動時間だけ
+
+結果は JSON で保存し、--compare で前回の結果と比べられる。
+"""
+import argparse
+import base64
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from wordtest.compiled import EXTENSION, compile_df
+from wordtest.distractors import DistractorIndex, guess_pos, tag_pos
+from wordtest.plan import build_plan, question_rows
+from wordtest.questions import QuestionEngine, select_questions, select_variants
+from wordtest.render import PREVIEW_PAGES, count_pages, create_pdf, fit_text, render_pages, warm_fit_cache
+from wordtest.wordbook import read_wordbook
+
+DATA_DIR = "単語data"
+RESULTS_DIR = "bench_results"
+
+_SUFFIXES = ["する", "る", "い", "な", "の", "に", "", "", ""]
+
+
+def write_synthetic_book(path, n_words, seed=0):
+    """ランダムな英単語・訳語で n_words 語の CSV を作る（品詞の偏りも本物に近づける）"""
+    rng = random.Random(seed)
+    kana = [chr(c) for c in range(ord("ぁ"), ord("ゖ"))]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,english,japanese\n")
+        for i in range(1, n_words + 1):
+            english = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 12)))
+            japanese = "".join(rng.choice(kana) for _ in range(rng.randint(2, 6))) + rng.choice(_SUFFIXES)
+            f.write(f"{i},{english},{japanese}\n")
+
+
+def measure(func, repeat, setup=None):
+    """func を repeat 回実行して最速の経過時間を、別の 1 回でピークメモリを測る"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def bench_book(path, repeat, pdf_items):
+    name = os.path.basename(path)
+    rows = []
+
+    def record(stage, seconds, peak, pages=None, **extra):
+        row = {"book": name, "stage": stage, "seconds": seconds, "peak_bytes": peak}
+        if pages is not None:
+            row["pages"] = pages
+            row["pages_per_sec"] = pages / seconds if seconds else None
+        row.update(extra)
+        rows.append(row)
+        print(f"  {stage:<24} {seconds * 1000:10.1f} ms  {peak / 1e6:8.1f} MB"
+              + (f"  {row['pages_per_sec']:8.1f} pages/s" if pages else ""))
+
+    print(f"{name}")
+    book, seconds, peak = measure(lambda: read_wordbook(path), repeat)
+    record("load_data", seconds, peak, words=len(book))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compiled_path = os.path.join(tmp, book.key + EXTENSION)
+        compile_df(book.df, compiled_path, name, book.content_hash)
+        _, seconds, peak = measure(lambda: read_wordbook(compiled_path), repeat)
+        record("load_data (.wbk)", seconds, peak, file_bytes=os.path.getsize(compiled_path))
+
+    meanings = book.df['japanese'].dropna().unique().tolist()
+    _, seconds, peak = measure(lambda: [guess_pos(m) for m in meanings], repeat)
+    record("guess_pos", seconds, peak, meanings=len(meanings))
+
+    _, seconds, peak = measure(lambda: tag_pos(book.df), repeat)
+    record("tag_pos", seconds, peak, rows=len(book))
+
+    index, seconds, peak = measure(lambda: DistractorIndex.from_df(book.df), repeat)
+    record("distractor_index", seconds, peak)
+
+    n = min(pdf_items, len(book))
+    _, seconds, peak = measure(lambda: select_questions(book.df, n, "ランダム", 0), repeat)
+    record("select_questions", seconds, peak, rows=len(book), questions=n)
+
+    _, seconds, peak = measure(lambda: select_variants(book.df, n, "ランダム", 0, 3, "品詞"), repeat)
+    record("select_variants x3 (品詞)", seconds, peak, rows=len(book), questions=n)
+
+    records = question_rows(book.df.head(pdf_items))
+    engine = QuestionEngine(index, book.key, 0)
+    for test_type in ("4択式", "記述式"):
+        plan, seconds, peak = measure(lambda: build_plan(records, engine, test_type), repeat)
+        record(f"build_plan {test_type}", seconds, peak, questions=len(records))
+
+        pages = count_pages(plan)
+        # 単語帳の温め（warm_fit_cache）の直後なら、描画中の文字の計測はすべてキャッシュに当たるはず
+        fit_text.cache_clear()
+        warm_fit_cache(records)
+        before = fit_text.cache_info()
+        create_pdf(plan, "ベンチマーク", include_answers=True)
+        after = fit_text.cache_info()
+        hits, misses = after.hits - before.hits, after.misses - before.misses
+        rows.append({"book": name, "stage": f"fit_cache {test_type}", "seconds": None, "peak_bytes": None,
+                     "hits": hits, "misses": misses})
+        print(f"  {'fit_cache ' + test_type:<24} {hits:7d} hits {misses:7d} misses"
+              + ("  ← warm_fit_cache が効いていない" if misses else ""))
+
+        pdf, seconds, peak = measure(lambda: create_pdf(plan, "ベンチマーク", include_answers=True).getvalue(),
+                                     repeat, setup=fit_text.cache_clear)
+        record(f"create_pdf {test_type}", seconds, peak, pages=pages, pdf_bytes=len(pdf))
+
+        _, seconds, peak = measure(lambda: base64.b64encode(pdf), repeat)
+        record(f"base64 {test_type}", seconds, peak)
+
+        preview = list(range(min(PREVIEW_PAGES, pages)))
+        _, seconds, peak = measure(lambda: render_pages(plan, "ベンチマーク", False, preview).getvalue(),
+                                   repeat, setup=fit_text.cache_clear)
+        record(f"preview {test_type}", seconds, peak, pages=len(preview))
+    return rows
+
+
+_STARTUP_SCRIPT = """
+import json, logging, runpy, sys, time
+start = time.perf_counter()
+import streamlit
+imported = time.perf_counter()
+logging.disable(logging.WARNING)
+runpy.run_path(sys.argv[1], run_name="__main__")
+first = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="__main__")
+rerun = time.perf_counter()
+print(json.dumps({"streamlit_import": imported - start, "first_run": first - imported, "rerun": rerun - first}))
+"""
+
+
+def bench_startup(app_path, repeat):
+    """新しいプロセスで app.py を（Streamlit のサーバーなしで）実行し、画面を組み立てる時間を測る
+
+    first_run はコールドスタートからサイドバーが出るまで（モジュール・単語帳の読み込みを含む）、
+    rerun は操作のたびの再実行にあたる。作成ボタンは押されない扱いなので PDF は作らない。
+    """
+    app_path = os.path.abspath(app_path)
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, app_path], capture_output=True,
+                             text=True, check=True, cwd=os.path.dirname(app_path)).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    print("app.py")
+    rows = []
+    for stage in ("streamlit_import", "first_run", "rerun"):
+        seconds = min(run[stage] for run in runs)
+        rows.append({"book": "app.py", "stage": f"startup {stage}", "seconds": seconds, "peak_bytes": None})
+        print(f"  {'startup ' + stage:<24} {seconds * 1000:10.1f} ms")
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, rows):
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["book"], r["stage"]): r for r in json.load(f)["results"]}
+    print(f"\n比較: {old_path}")
+    for row in rows:
+        before = old.get((row["book"], row["stage"]))
+        if before is None or not before["seconds"]:
+            continue
+        ratio = row["seconds"] / before["seconds"]
+        print(f"  {row['book'][:28]:<28} {row['stage']:<24} {before['seconds'] * 1000:9.1f} → "
+              f"{row['seconds'] * 1000:9.1f} ms  (x{ratio:.2f})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--sizes", default="10000,100000", help="合成単語帳の語数（カンマ区切り、空で省略）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pdf-items", type=int, default=2000, help="PDF にする問題数の上限")
+    parser.add_argument("--output", help="結果の JSON（省略時は bench_results/<日時>.json）")
+    parser.add_argument("--compare", help="比較する過去の結果 JSON")
+    parser.add_argument("--app", default="app.py", help="起動時間を測るアプリ")
+    parser.add_argument("--startup-only", action="store_true", help="アプリの起動時間だけを測る")
+    args = parser.parse_args(argv)
+
+    paths = [] if args.startup_only else sorted(glob.glob(os.path.join(args.data_dir, "*.csv")))
+    rows = bench_startup(args.app, args.repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        sizes = [] if args.startup_only else [int(s) for s in args.sizes.split(",") if s.strip()]
+        for size in sizes:
+            path = os.path.join(tmp, f"synthetic_{size}.csv")
+            write_synthetic_book(path, size)
+            paths.append(path)
+        for path in paths:
+            rows.extend(bench_book(path, args.repeat, args.pdf_items))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "pdf_items": args.pdf_items,
+            "results": rows,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n保存しました: {output}")
+
+    if args.compare:
+        compare(args.compare, rows)
+
+
+if __name__ == "__main__":
+    main()
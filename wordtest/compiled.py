@@ -0,0 +1,214 @@
+"""単語帳のバイナリ形式（.wbk）への変換と読み込み
+
+    python -m wordtest.compiled 単語data/*.csv
+    python -m wordtest.compiled 単語data/raw.txt -o "単語data/速読英熟語 【改訂版】.wbk"
+
+CSV（id,english,japanese、任意で pos）と、raw.txt のようなタブ区切り（id, 英語, 日本語）を
+読み込める。タブ区切りの〔言い換え〕と（補足）は取り除き、英語の ～ / ... は消す。
+訳語の ～ / ... は CSV と同じく、先頭・末尾のものは消して途中のものは 〜 にする。
+
+ファイルの中身は列ごとの配列で、mmap してそのまま読める:
+
+    "WBK1" + ヘッダー長 (uint32) + ヘッダー JSON
+    id        int64   [行数]
+    english   uint32  [行数]   文字列プールの番号
+    japanese  uint32  [行数]   文字列プールの番号（欠損は MISSING）
+    pos       uint8   [行数]   POS_TAGS の番号（tag_pos の結果。pos 列があればそれを優先）
+    offsets   uint32  [文字列数 + 1]   文字列プール内のバイト位置
+    strings   bytes    UTF-8 文字列を NUL 区切りで連結（重複は 1 つにまとめる）
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+from wordtest.distractors import POS_TAGS, tag_pos
+
+MAGIC = b"WBK1"
+VERSION = 1
+EXTENSION = ".wbk"
+MISSING = 0xFFFFFFFF
+_ALIGN = 8
+
+_SECTIONS = (
+    ("id", "<i8"),
+    ("english", "<u4"),
+    ("japanese", "<u4"),
+    ("pos", "u1"),
+    ("offsets", "<u4"),
+)
+
+
+def _strip_notes(text):
+    """〔言い換え〕 / （補足）を取り除く"""
+    text = re.sub(r"〔[^〕]*〕", "", text)
+    # 「B(原料）」のような全角・半角の混ざった括弧や入れ子の括弧も、内側から順に取り除く
+    while True:
+        text, n = re.subn(r"[(（][^()（）]*[)）]", "", text)
+        if not n:
+            return text
+
+
+def normalize_raw(text):
+    """raw.txt の英語の表記から ～ / ... / 〔言い換え〕 / （補足）を取り除く"""
+    text = _strip_notes(text).replace("～", "").replace("...", "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_raw_japanese(text):
+    """raw.txt の訳語の表記を整える（〔言い換え〕 / （補足）と、先頭・末尾の ～ / ... は取り除く）
+
+    途中の ～ / ... は「共通の～を持つ」のように意味の一部なので、消さずに CSV と同じ 〜 にする。
+    """
+    text = re.sub(r"\s*(?:～|\.\.\.|…)\s*", "〜", _strip_notes(text))
+    return re.sub(r"\s+", " ", text).strip(" 〜")
+
+
+def read_source(path):
+    """CSV または タブ区切りテキストを DataFrame にする（id, english, japanese）"""
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path)
+    df = pd.read_csv(path, sep="\t", header=None, names=["id", "english", "japanese"],
+                     dtype={"english": str, "japanese": str}, quoting=3)
+    df = df.dropna(subset=["id"])
+    df["english"] = df["english"].fillna("").map(normalize_raw)
+    df["japanese"] = df["japanese"].fillna("").map(normalize_raw_japanese)
+    return df
+
+
+def compile_df(df, out_path, source_name="", source_hash=""):
+    ids = df["id"].to_numpy(dtype=np.int64)
+
+    pool = {}
+    def intern(values):
+        codes = np.empty(len(values), dtype=np.uint32)
+        for i, value in enumerate(values):
+            if pd.isna(value):
+                codes[i] = MISSING
+            else:
+                codes[i] = pool.setdefault(str(value), len(pool))
+        return codes
+
+    english = intern(df["english"].tolist())
+    japanese = intern(df["japanese"].tolist())
+    pos = pd.Series(tag_pos(df)).map({tag: i for i, tag in enumerate(POS_TAGS)}).to_numpy(dtype=np.uint8)
+
+    encoded = [s.encode("utf-8") for s in pool]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(b) + 1 for b in encoded], out=offsets[1:])
+    strings = b"\0".join(encoded) + b"\0" if encoded else b""
+
+    arrays = {"id": ids, "english": english, "japanese": japanese, "pos": pos, "offsets": offsets}
+    header = {
+        "version": VERSION,
+        "rows": len(ids),
+        "strings": len(encoded),
+        "pos_tags": list(POS_TAGS),
+        "source": source_name,
+        "source_hash": source_hash,
+        "sections": {},
+    }
+    # オフセットはヘッダーの長さで変わり、ヘッダーはオフセットを含むので、変わらなくなるまで組み立て直す
+    while True:
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        offset = _aligned(len(MAGIC) + 4 + len(header_bytes))
+        sections = {}
+        for name, dtype in _SECTIONS:
+            sections[name] = [offset, dtype, len(arrays[name])]
+            offset = _aligned(offset + arrays[name].nbytes)
+        sections["strings"] = [offset, "u1", len(strings)]
+        if sections == header["sections"]:
+            break
+        header["sections"] = sections
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        for name, _ in _SECTIONS:
+            f.write(b"\0" * (sections[name][0] - f.tell()))
+            f.write(arrays[name].tobytes())
+        f.write(b"\0" * (sections["strings"][0] - f.tell()))
+        f.write(strings)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def compile_file(src_path, out_path=None):
+    """CSV / タブ区切りを .wbk に変換する（出力先の既定は元ファイルの隣）"""
+    if out_path is None:
+        out_path = os.path.splitext(src_path)[0] + EXTENSION
+    with open(src_path, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    df = read_source(src_path)
+    return compile_df(df, out_path, os.path.basename(src_path), source_hash)
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class CompiledBook:
+    """.wbk を mmap して、列を numpy 配列として見せる（コピーしない）"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{os.path.basename(path)} は単語帳のバイナリ形式ではありません。")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._mm[start:start + header_len].decode("utf-8"))
+        if self.header["version"] != VERSION:
+            raise ValueError(f"{os.path.basename(path)} の形式のバージョンが違います。")
+        for name, (offset, dtype, count) in self.header["sections"].items():
+            setattr(self, name, np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset))
+
+    def string(self, code):
+        if code == MISSING:
+            return None
+        return bytes(self.strings[self.offsets[code]:self.offsets[code + 1] - 1]).decode("utf-8")
+
+    def string_pool(self):
+        """文字列プール全体を一度に復号する（末尾に欠損用の NaN を足してある）"""
+        pool = self.strings.tobytes().decode("utf-8").split("\0")[:-1] if len(self.strings) else []
+        return np.array(pool + [np.nan], dtype=object)
+
+    def to_df(self):
+        pool = self.string_pool()
+        missing = len(pool) - 1
+        english = np.where(self.english == MISSING, missing, self.english)
+        japanese = np.where(self.japanese == MISSING, missing, self.japanese)
+        return pd.DataFrame({
+            "id": np.array(self.id),
+            "english": pool[english],
+            "japanese": pool[japanese],
+        })
+
+    def pos_tags(self):
+        tags = np.array(self.header["pos_tags"], dtype=object)
+        return tags[self.pos]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="CSV またはタブ区切りのファイル")
+    parser.add_argument("-o", "--output", help="出力先（入力が 1 つのときのみ）")
+    args = parser.parse_args(argv)
+    if args.output and len(args.sources) > 1:
+        parser.error("-o は入力ファイルが 1 つのときだけ指定できます")
+
+    for src in args.sources:
+        out = compile_file(src, args.output)
+        print(f"{src} → {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+# Streamlit の静的ファイル配信（.streamlit/config.toml の enableStaticServing）で
+# static/ 以下が app/static/ として配信される
+STATIC_DIR = "static"
+PDF_SUBDIR = "pdf"
+MAX_PUBLISHED = 200
+CHUNK_SIZE = 1 << 20
+
+# PDF キャッシュのキー → 配信中のファイル名（ファイルに直接書き出した大きな PDF 用）
+_by_key = collections.OrderedDict()
+_by_key_lock = threading.Lock()
+
+
+def publish_pdf(data, static_dir=STATIC_DIR):
+    """PDF を静的配信フォルダに置き、ブラウザから開ける相対 URL を返す
+
+    ファイル名は中身のハッシュなので、同じ PDF は一度しか書き込まない。
+    """
+    name = hashlib.sha256(data).hexdigest()[:32] + ".pdf"
+    out_dir = os.path.join(static_dir, PDF_SUBDIR)
+    path = os.path.join(out_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        # 書きかけのファイルが配信されないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        _prune(out_dir)
+    return f"app/static/{PDF_SUBDIR}/{name}"
+
+
+def open_published_tmp(static_dir=STATIC_DIR):
+    """配信フォルダ内に一時ファイルを作り、(書き込み用ファイル, パス) を返す（publish_file に渡す）"""
+    out_dir = os.path.join(static_dir, PDF_SUBDIR)
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+def publish_file(tmp_path, key=None, static_dir=STATIC_DIR):
+    """open_published_tmp で書いた PDF をハッシュ名に置き換えて配信し、URL を返す
+
+    ハッシュは少しずつ読んで計算するので、PDF 全体をメモリに載せない。
+    key を渡すと published_url(key) で後から同じ URL を引ける。
+    """
+    digest = hashlib.sha256()
+    with open(tmp_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    name = digest.hexdigest()[:32] + ".pdf"
+    out_dir = os.path.join(static_dir, PDF_SUBDIR)
+    path = os.path.join(out_dir, name)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        os.utime(path)
+    else:
+        os.replace(tmp_path, path)
+        _prune(out_dir)
+    if key is not None:
+        with _by_key_lock:
+            _by_key[key] = name
+            _by_key.move_to_end(key)
+            while len(_by_key) > MAX_PUBLISHED:
+                _by_key.popitem(last=False)
+    return f"app/static/{PDF_SUBDIR}/{name}"
+
+
+def published_url(key, static_dir=STATIC_DIR):
+    """publish_file(key=...) で配信した PDF の URL（消えていれば None）"""
+    with _by_key_lock:
+        name = _by_key.get(key)
+    if name is None or not os.path.exists(os.path.join(static_dir, PDF_SUBDIR, name)):
+        return None
+    return f"app/static/{PDF_SUBDIR}/{name}"
+
+
+def local_path(url, static_dir=STATIC_DIR):
+    """配信 URL（app/static/...）に対応するローカルのパス"""
+    return os.path.join(static_dir, url.split("app/static/", 1)[1])
+
+
+def _prune(out_dir, keep=MAX_PUBLISHED):
+    """古いものから消して、置いておく PDF を keep 個までにする"""
+    entries = []
+    for entry in os.scandir(out_dir):
+        if entry.name.endswith(".pdf"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    if len(entries) <= keep:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,129 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+POS_TAGS = ("verb_like", "adj_like", "noun_like", "adv_like")
+
+
+def guess_pos(text):
+    text = str(text).strip()
+    if "～" in text or text.endswith("する") or text.endswith("る"):
+        return "verb_like"
+    elif text.endswith("い") or text.endswith("な") or text.endswith("の"):
+        return "adj_like"
+    elif text.endswith("に") and len(text) > 1:
+        return "adv_like"
+    else:
+        return "noun_like"
+
+
+# CSV の pos 列に書ける表記 → 品詞タグ（空欄や知らない表記は guess_pos で推定する）
+POS_ALIASES = {
+    "verb_like": "verb_like", "verb": "verb_like", "v": "verb_like", "動詞": "verb_like", "動": "verb_like",
+    "adj_like": "adj_like", "adj": "adj_like", "a": "adj_like", "形容詞": "adj_like", "形容動詞": "adj_like", "形": "adj_like",
+    "noun_like": "noun_like", "noun": "noun_like", "n": "noun_like", "名詞": "noun_like", "名": "noun_like",
+    "adv_like": "adv_like", "adv": "adv_like", "副詞": "adv_like", "副": "adv_like",
+}
+
+
+def guess_pos_array(values):
+    """guess_pos を列全体にまとめてかける（1 件ずつ呼んだ場合と同じ結果の配列を返す）"""
+    text = pd.Series(values, copy=False).astype(str).str.strip()
+
+    def mask(result):
+        return result.fillna(False).to_numpy(dtype=bool)
+
+    verb = mask(text.str.contains("～", regex=False) | text.str.endswith("る"))
+    adj = mask(text.str.endswith(("い", "な", "の")))
+    adv = mask(text.str.endswith("に") & (text.str.len() > 1))
+    codes = np.select([verb, adj, adv], [0, 1, 3], 2)
+    return np.array(POS_TAGS, dtype=object)[codes]
+
+
+def tag_pos(df):
+    """行ごとの品詞タグ。pos 列があれば、読み取れる行はそれを使い、残りは訳語から推定する"""
+    tags = guess_pos_array(df['japanese'])
+    if 'pos' in df.columns:
+        given = df['pos'].astype(str).str.strip().str.lower().map(POS_ALIASES).to_numpy(dtype=object)
+        known = pd.notna(given)
+        tags[known] = given[known]
+    return tags
+
+
+def sample_excluding(population, skip, k, rng=random):
+    """population から skip 番目を除いて k 個選ぶ
+
+    除外済みのリストを作らずに、長さ n-1 の添字を引いてずらすだけにしている。
+    random.sample は添字しか見ないので、除外済みリストから引いた場合と
+    同じ乱数列なら同じ結果になる。
+    """
+    n = len(population) - (1 if skip is not None else 0)
+    picked = rng.sample(range(n), k)
+    if skip is None:
+        return [population[j] for j in picked]
+    return [population[j if j < skip else j + 1] for j in picked]
+
+
+class DistractorIndex:
+    """4択の誤答候補を引くための索引（単語帳ごとに一度だけ作る）
+
+    meanings: 重複を除いた訳語（出現順）
+    pos:      meanings と同じ並びの品詞タグ
+    buckets:  品詞タグ → その品詞の訳語リスト
+    """
+
+    def __init__(self, meanings=(), pos=None):
+        self.meanings = []
+        self.pos = []
+        self.buckets = {tag: [] for tag in POS_TAGS}
+        self._where = {}
+        self.extend(meanings, pos)
+
+    def extend(self, meanings, pos=None):
+        """訳語を追加する（すでにある訳語は飛ばす）。追加分だけの手間で済む"""
+        meanings = list(meanings)
+        if pos is None:
+            pos = guess_pos_array(meanings) if meanings else []
+        for m, tag in zip(meanings, pos):
+            if m in self._where:
+                continue
+            self._where[m] = (len(self.meanings), tag, len(self.buckets[tag]))
+            self.meanings.append(m)
+            self.pos.append(tag)
+            self.buckets[tag].append(m)
+
+    @classmethod
+    def from_df(cls, df, row_pos=None):
+        """row_pos（行ごとの品詞タグ）を渡すとそれを使い、省略時は tag_pos で求める
+
+        同じ訳語が複数の行にあるときは、最初の行の品詞になる。
+        """
+        if row_pos is None:
+            row_pos = tag_pos(df)
+        codes, uniques = pd.factorize(df['japanese'])
+        valid = codes >= 0
+        _, first_rows = np.unique(codes[valid], return_index=True)
+        first_rows = np.flatnonzero(valid)[first_rows]
+        return cls(uniques.tolist(), np.asarray(row_pos)[first_rows].tolist())
+
+    def pos_of(self, meaning):
+        hit = self._where.get(meaning)
+        return hit[1] if hit is not None else guess_pos(meaning)
+
+    def candidate_count(self, meaning):
+        """meaning と同じ品詞で、meaning 以外の候補数"""
+        hit = self._where.get(meaning)
+        if hit is None:
+            return len(self.buckets[guess_pos(meaning)])
+        return len(self.buckets[hit[1]]) - 1
+
+    def sample_same_pos(self, meaning, k=3, rng=random):
+        hit = self._where.get(meaning)
+        if hit is None:
+            return sample_excluding(self.buckets[guess_pos(meaning)], None, k, rng)
+        return sample_excluding(self.buckets[hit[1]], hit[2], k, rng)
+
+    def sample_any(self, meaning, k=3, rng=random):
+        hit = self._where.get(meaning)
+        return sample_excluding(self.meanings, hit[0] if hit is not None else None, k, rng)
@@ -0,0 +1,96 @@
+"""生徒の解答を解答マニフェストと照らし合わせて、まとめて採点する
+
+    python -m wordtest.grade answers.csv
+    python -m wordtest.grade answers.csv --manifests batch_output/manifests --output scores.csv
+    python -m wordtest.grade answers.csv --record     # 結果を記録して「復習優先」の出題に使う
+
+answers.csv の列（1 行 = 1 人分の答案）:
+
+    student   生徒名（--record のときはこの名前で記録する）
+    test_id   テスト ID（QR コードを読み取った "WT1:..." / "WT1K:..." の文字列をそのまま入れてもよい）
+    answers   解答。4択式は "3142 2113..." のような番号の並び（0 / - / _ は無回答）、
+              記述式はタブか半角カンマ区切りの訳語（訳語の「、」「，」では区切らない）
+
+4択式のテストは、test_id に模範解答の QR コード（"WT1K:..."、正解番号入り）を入れれば
+マニフェストがなくても採点できる（ただし --record にはマニフェストの出題 ID が必要）。
+問題用紙の QR コードにはテスト ID しか入っていない。
+"""
+import argparse
+import csv
+import sys
+
+from wordtest.manifest import MANIFEST_DIR, grade, is_qr_payload, load_manifest, parse_answers, parse_qr_payload
+
+
+def resolve_manifest(test_ref, manifest_dir, cache):
+    """テスト ID（または QR の文字列）からマニフェストを引く
+
+    マニフェストがないときは、模範解答の QR コードの正解番号で代わりにする。
+    """
+    tid, qr_answers = test_ref.strip(), ""
+    if is_qr_payload(tid):
+        tid, qr_answers = parse_qr_payload(tid)
+    if tid not in cache:
+        try:
+            cache[tid] = load_manifest(tid, manifest_dir)
+        except FileNotFoundError:
+            if not qr_answers:
+                raise
+            cache[tid] = {"test_id": tid, "answers": qr_answers}
+    return cache[tid]
+
+
+def grade_row(row, manifest_dir=MANIFEST_DIR, cache=None):
+    """answers.csv の 1 行を採点し、(マニフェスト, 採点結果) を返す"""
+    manifest = resolve_manifest(row["test_id"], manifest_dir, {} if cache is None else cache)
+    return manifest, grade(manifest, parse_answers(row.get("answers", ""), manifest["answers"]))
+
+
+def record_results(store, student, manifest, result):
+    if "ids" not in manifest:
+        raise ValueError(f"テスト {manifest['test_id']} のマニフェストがないため記録できません")
+    books = manifest.get("books") or [manifest["book"]] * len(manifest["ids"])
+    return store.record(student, zip(books, manifest["ids"], result["marks"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("answers", help="解答の CSV（student, test_id, answers）")
+    parser.add_argument("--manifests", default=MANIFEST_DIR, help="マニフェストのフォルダ")
+    parser.add_argument("--output", help="採点結果の CSV（省略時は標準出力）")
+    parser.add_argument("--record", action="store_true", help="結果を記録する（復習優先の出題に使う）")
+    args = parser.parse_args(argv)
+
+    store = None
+    if args.record:
+        from wordtest.results import default_store
+        store = default_store()
+
+    with open(args.answers, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    failed = 0
+    try:
+        writer = csv.writer(out)
+        writer.writerow(["student", "test_id", "score", "total", "wrong"])
+        manifests = {}
+        for line_no, row in enumerate(rows, start=2):
+            try:
+                manifest, result = grade_row(row, args.manifests, manifests)
+                if store is not None:
+                    record_results(store, row["student"], manifest, result)
+            except (FileNotFoundError, ValueError) as e:
+                failed += 1
+                print(f"{args.answers}:{line_no}: {e}", file=sys.stderr)
+                continue
+            writer.writerow([row["student"], result["test_id"], result["score"], result["total"],
+                             " ".join(map(str, result["wrong"]))])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
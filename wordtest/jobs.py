@@ -0,0 +1,124 @@
+"""PDF の描画を共有のワーカースレッドで行うジョブ
+
+Streamlit は操作のたびにスクリプトを実行し直すので、描画をスクリプトの中で行うと
+その間は画面が固まり、途中で設定を触ると最初からやり直しになる。ここではジョブとして
+プロセス共有のスレッドプールに投げ、結果は RenderJob に残して後の再実行から取りに来る。
+
+    job = render_jobs.submit(job_id, lambda progress: ..., total_pages)
+    job.progress  # 0.0 ～ 1.0（描き終えたページ数から）
+    job.result    # 終わっていれば fn の戻り値
+
+同じ job_id（= 同じ PDF を作る設定）のジョブが実行中・完了済みなら、新しく作らずにそれを返す。
+"""
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+from wordtest import timing
+
+MAX_WORKERS = int(os.environ.get("WORDTEST_RENDER_WORKERS", "2"))
+MAX_FINISHED = 32  # 結果を取りに来られるよう残しておく完了済みジョブの数
+
+
+class RenderJob:
+    def __init__(self, job_id, total_pages):
+        self.id = job_id
+        self.total_pages = total_pages
+        self.pages_done = 0
+        self.status = "queued"  # queued → running → done / error
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timer = None  # 描画の処理時間の内訳（timing.RequestTimer。終わってから読む）
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        return min(self.pages_done / self.total_pages, 1.0) if self.total_pages else 0.0
+
+    def report(self, done, total):
+        """描画側から 1 ページごとに呼ばれる（done: ここまでに描いたページ数）"""
+        self.pages_done = done
+        self.total_pages = total
+
+    def timings(self):
+        """待ち行列にいた時間と実行にかかった時間（ミリ秒、終わっていないものは None）"""
+        queued = self.started_at - self.submitted_at if self.started_at is not None else None
+        running = self.finished_at - self.started_at if self.finished_at is not None and self.started_at is not None else None
+        return {"queued_ms": queued and round(queued * 1000, 1), "run_ms": running and round(running * 1000, 1)}
+
+    def wait(self, timeout=None):
+        """終わるまで待ち、終わっていれば True"""
+        return self._done.wait(timeout)
+
+
+class JobPool:
+    def __init__(self, max_workers=MAX_WORKERS, max_finished=MAX_FINISHED):
+        self.max_finished = max_finished
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wordtest-render")
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, fn, total_pages=0, inline=False):
+        """fn(progress) を実行するジョブを投げる。同じ job_id のジョブがあればそれを返す
+
+        失敗したジョブは、同じ job_id で投げ直したときにやり直す。
+        inline=True なら呼び出したスレッドでその場で実行する（プロファイル用）。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != "error":
+                self._jobs.move_to_end(job_id)
+                return job
+            job = RenderJob(job_id, total_pages)
+            self._jobs[job_id] = job
+            self._prune()
+        if inline:
+            self._run(job, fn)
+        else:
+            self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started_at = time.time()
+        # span はリクエストのタイマーではなくジョブ自身のタイマーに記録する（スレッド間で共有しない）
+        job.timer = timing.RequestTimer("render_job", job_id=job.id)
+        try:
+            with timing.recording(job.timer):
+                job.result = fn(job.report)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            counts = collections.Counter(job.status for job in self._jobs.values())
+        return dict(counts)
+
+
+# プロセス内の全セッションで共有する
+render_jobs = JobPool()
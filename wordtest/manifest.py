@@ -0,0 +1,154 @@
+"""解答マニフェスト（テストごとの正解一覧）と採点
+
+テスト ID は (単語帳の内容ハッシュ, 出題 ID の並び, 形式, シード, 正解番号) から決まるので、
+同じテストを作り直せば同じ ID になり、誤答の選び方を変えて正解が変わったものは別の ID になる。
+マニフェストにはテストを再現するのに必要な情報（単語帳・シード・出題 ID・誤答の選び方と
+4択の選択肢）と正解を入れ、
+PDF のヘッダーには QR コード（qr_payload）で印刷する。問題用紙の QR コードにはテスト ID だけを入れ、
+正解番号は模範解答の QR コードにだけ入れる（生徒が自分の問題用紙から正解を読み取れないように）。
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_DIR = os.environ.get("WORDTEST_MANIFEST_DIR", "manifests")
+VERSION = 2  # 2: distractors と choices を追加
+QR_PREFIX = "WT1"
+QR_KEY_PREFIX = "WT1K"  # 模範解答の QR コード（正解番号入り）
+QR_MAX_ANSWERS = 200  # これより問題が多いと QR コードが細かくなりすぎるので、テスト ID だけにする
+
+
+def test_id(book_hash, plan):
+    material = json.dumps([
+        book_hash,
+        [[item.book, str(item.id)] for item in plan.items],
+        plan.test_type,
+        plan.seed,
+        [item.answer for item in plan.items],
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:12]
+
+
+def build_manifest(book_hash, plan, title="", distractors=None):
+    """TestPlan から解答マニフェスト（dict）を作る
+
+    4択式の answers は正解番号を並べた文字列（"3142..."）、記述式は訳語のリスト。
+    distractors は 4択の誤答の選び方（"同じ品詞" / "似た訳語"）。誤答の索引は単語帳の版や
+    計算方法で変わりうるので、4択式は選択肢そのもの（choices）も入れておく。
+    """
+    if plan.test_type == "記述式":
+        answers = [str(item.japanese) for item in plan.items]
+    else:
+        answers = "".join(str(item.answer) for item in plan.items)
+    return {
+        "version": VERSION,
+        "test_id": test_id(book_hash, plan),
+        "title": title,
+        "book": plan.book_key,
+        "book_hash": book_hash,
+        "test_type": plan.test_type,
+        "seed": plan.seed,
+        "ids": [item.id for item in plan.items],
+        "books": [item.book for item in plan.items] if any(item.book for item in plan.items) else None,
+        "distractors": distractors if plan.test_type != "記述式" else None,
+        "choices": [list(item.choices) for item in plan.items] if plan.test_type != "記述式" else None,
+        "answers": answers,
+    }
+
+
+def qr_payload(manifest, answer_key=False):
+    """QR コードに入れる文字列
+
+    問題用紙は "WT1:<テストID>"。answer_key=True（模範解答）なら "WT1K:<テストID>:<正解番号の並び>"。
+    記述式と、QR_MAX_ANSWERS 問より多いテストは模範解答でも正解を入れない（マニフェストから引く）。
+    """
+    if not answer_key:
+        return f"{QR_PREFIX}:{manifest['test_id']}"
+    answers = manifest["answers"] if isinstance(manifest["answers"], str) else ""
+    if len(answers) > QR_MAX_ANSWERS:
+        answers = ""
+    return f"{QR_KEY_PREFIX}:{manifest['test_id']}:{answers}"
+
+
+def qr_codes(manifest):
+    """render_sheets に渡す QR コードの文字列（問題用紙用と模範解答用）"""
+    return {"code": qr_payload(manifest), "answer_code": qr_payload(manifest, answer_key=True)}
+
+
+def is_qr_payload(text):
+    return text.strip().startswith((QR_PREFIX + ":", QR_KEY_PREFIX + ":"))
+
+
+def parse_qr_payload(text):
+    """qr_payload の逆。(テストID, 正解番号の並び) を返す
+
+    正解番号は模範解答の QR コード（WT1K）のものだけを返す。問題用紙の QR コードは
+    テスト ID だけを使う（以前の版で問題用紙に入っていた正解番号は使わない）。
+    """
+    prefix, tid, *rest = text.strip().split(":", 2)
+    if prefix not in (QR_PREFIX, QR_KEY_PREFIX):
+        raise ValueError(f"テストの QR コードではありません: {text}")
+    return tid, rest[0] if prefix == QR_KEY_PREFIX and rest else ""
+
+
+def save_manifest(manifest, manifest_dir=MANIFEST_DIR):
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, manifest["test_id"] + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return path
+
+
+def load_manifest(tid, manifest_dir=MANIFEST_DIR):
+    path = os.path.join(manifest_dir, tid + ".json")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"テスト {tid} のマニフェストがありません（{manifest_dir}）")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_answers(text, key=None):
+    """生徒の解答欄を 1 問ずつのリストにする
+
+    "3142 21" のような数字の並び（空白は無視、0 / - / _ は無回答）か、
+    タブ区切り・半角カンマ区切り（記述式の訳語など）のどちらでもよい。
+    訳語には「、」や「，」が入っているものがあるので、それでは区切らない。
+    key（マニフェストの answers）を渡すと、区切り文字を含む正解の分は続けて 1 問として読む。
+    """
+    text = str(text).strip()
+    if "\t" in text or "," in text:
+        sep = "\t" if "\t" in text else ","
+        parts = text.split(sep)
+        if key is not None and not isinstance(key, str):
+            parts = _align_parts(parts, key, sep)
+        return [part.strip() for part in parts]
+    return [ch for ch in text if not ch.isspace()]
+
+
+def _align_parts(parts, key, sep):
+    """正解 key[no] が sep を n 個含むなら、解答の n + 1 個分をつなげてその問題の解答にする"""
+    aligned = []
+    pos = 0
+    for correct in key:
+        if pos >= len(parts):
+            break
+        width = str(correct).count(sep) + 1
+        aligned.append(sep.join(parts[pos:pos + width]))
+        pos += width
+    return aligned + parts[pos:]
+
+
+def grade(manifest, answers):
+    """answers（parse_answers の結果）を採点し、問題ごとの正誤と点数を返す"""
+    key = list(manifest["answers"])
+    marks = []
+    for no, correct in enumerate(key):
+        given = answers[no] if no < len(answers) else ""
+        marks.append(given.strip() == str(correct).strip() and given not in ("", "0", "-", "_"))
+    return {
+        "test_id": manifest["test_id"],
+        "score": sum(marks),
+        "total": len(key),
+        "marks": marks,
+        "wrong": [no + 1 for no, ok in enumerate(marks) if not ok],
+    }
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 512 * 1024 * 1024
+KEY_VERSION = 2  # 2: 問題用紙の QR コードから正解番号を外した（それ以前に描いた PDF は使わない）
+
+
+def pdf_cache_key(book_hash, plan, title, include_answers, pages=None):
+    """PDF の中身を決めるものだけからキーを作る
+
+    出題 ID の並び・形式・シードが同じでも、誤答の選び方で選択肢が変わるので、
+    選択肢も含めて単語帳の内容ハッシュと合わせればレンダリング結果は一意に決まる。
+    """
+    material = json.dumps([
+        KEY_VERSION,
+        book_hash,
+        [[str(item.id), item.choices and [str(c) for c in item.choices]] for item in plan.items],
+        plan.test_type,
+        title,
+        bool(include_answers),
+        plan.seed,
+        list(pages) if pages is not None else None,
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class PdfCache:
+    """作成済み PDF のキャッシュ（メモリ + 任意でディスク、どちらも LRU）
+
+    メモリ側はプロセス内の全セッションで共有し、disk_dir を指定すると
+    プロセスを再起動しても残るようにディスクにも保存する。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, disk_dir=None, max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._store(key, data)
+        self._write_disk(key, data)
+
+    def get_or_render(self, key, render):
+        """キャッシュになければ render() を呼んで PDF バイト列を作り、保存して返す"""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".pdf")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._disk_path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".pdf"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+# WORDTEST_PDF_CACHE_DIR を設定するとディスクにも保存する
+pdf_cache = PdfCache(disk_dir=os.environ.get("WORDTEST_PDF_CACHE_DIR") or None)
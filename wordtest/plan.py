@@ -0,0 +1,59 @@
+from itertools import repeat
+from typing import NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+
+class QuestionRow:
+    """出題する 1 行（build_plan に渡す。行ごとに dict を作らないための軽い入れ物）"""
+    __slots__ = ("id", "english", "japanese", "book")
+
+    def __init__(self, id, english, japanese, book=None):
+        self.id = id
+        self.english = english
+        self.japanese = japanese
+        self.book = book
+
+
+def question_rows(records):
+    """DataFrame（または dict のリスト）を QuestionRow のリストにする
+
+    DataFrame は列をまとめて取り出して組み立てる（to_dict('records') を通さない）。
+    """
+    if isinstance(records, pd.DataFrame):
+        books = records['book'].tolist() if 'book' in records.columns else repeat(None)
+        return [QuestionRow(*row) for row in zip(records['id'].tolist(), records['english'].tolist(),
+                                                 records['japanese'].tolist(), books)]
+    return [row if isinstance(row, QuestionRow) else QuestionRow(row['id'], row['english'], row['japanese'], row.get('book'))
+            for row in records]
+
+
+class PlanItem(NamedTuple):
+    id: int
+    english: str
+    japanese: str
+    choices: Optional[Tuple[str, str, str, str]] = None  # 4択式のみ
+    answer: int = 0  # 4択式の正解番号（1～4）
+    book: Optional[str] = None  # 複数の単語帳を混ぜたときの出典（単語帳キー）
+
+
+class TestPlan(NamedTuple):
+    """出題内容をすべて決めた状態のテスト（描画は含まない）
+
+    問題用紙と模範解答はどちらもこれから描くので、必ず同じ中身になる。
+    """
+    book_key: str
+    test_type: str
+    seed: int
+    items: Tuple[PlanItem, ...]
+
+
+def build_plan(records, engine, test_type):
+    """出題する行（DataFrame、QuestionRow または dict のリスト）から TestPlan を作る"""
+    rows = question_rows(records)
+    if test_type == "記述式":
+        items = [PlanItem(row.id, row.english, row.japanese, book=row.book) for row in rows]
+    else:
+        items = [PlanItem(row.id, row.english, row.japanese, tuple(choices), answer, row.book)
+                 for row, (choices, answer) in zip(rows, engine.choices_for_page(rows))]
+    return TestPlan(engine.book_key, test_type, engine.test_seed, tuple(items))
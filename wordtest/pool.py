@@ -0,0 +1,67 @@
+import hashlib
+
+import pandas as pd
+
+from wordtest.distractors import DistractorIndex
+from wordtest.similar import load_index
+
+
+class CombinedPool:
+    """複数の単語帳をまとめた出題プール
+
+    誤答索引は 1 つを共有し、単語帳を足すたびにその単語帳の分だけ追加する
+    （各単語帳の品詞タグは WordBook.distractors で計算済みのものを使う）。
+    同じ英語・訳語の組は最初の単語帳のものだけを出題する。
+    """
+
+    def __init__(self):
+        self.books = []
+        self.distractors = DistractorIndex()
+        self._similar = None
+
+    def add(self, book):
+        self.books.append(book)
+        index = book.distractors
+        self.distractors.extend(index.meanings, index.pos)
+        self._similar = None
+
+    @property
+    def similar(self):
+        """全単語帳の訳語をまとめた「似た訳語」の索引（近傍は使う分だけその場で計算する）"""
+        if self._similar is None:
+            self._similar = load_index(pd.concat([book.df for book in self.books]), self.content_hash)
+        return self._similar
+
+    @property
+    def key(self):
+        return "+".join(book.key for book in self.books)
+
+    @property
+    def content_hash(self):
+        material = "\x1f".join(book.content_hash for book in self.books)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def count(self, book_ranges):
+        return len(self.select(book_ranges))
+
+    def select(self, book_ranges):
+        """[(WordBook, 範囲のリスト), ...] の行をまとめる（book / book_no 列つき、重複は除く）"""
+        frames = []
+        for book_no, (book, ranges) in enumerate(book_ranges):
+            part = book.id_index.select(ranges)
+            frames.append(part.assign(book=book.key, book_no=book_no))
+        if not frames:
+            return pd.DataFrame(columns=['id', 'english', 'japanese', 'book', 'book_no'])
+        return pd.concat(frames).drop_duplicates(subset=['english', 'japanese'])
+
+
+def pool_for(pool, books):
+    """books（順番つき）に対応するプールを返す
+
+    前回のプールが books の先頭部分と同じなら、足りない単語帳だけを追加して使い回す。
+    """
+    if pool is None or pool.books != books[:len(pool.books)]:
+        pool = CombinedPool()
+    for book in books[len(pool.books):]:
+        pool.add(book)
+    return pool
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import random
+
+import numpy as np
+import pandas as pd
+
+from wordtest.distractors import tag_pos
+
+SIMILAR_POOL = 8  # 「似た訳語」の誤答は、似ている順の上位この数から 3 つ選ぶ
+
+
+def derive_seed(book_key, item_id, test_seed=0):
+    """(単語帳, 問題ID, テストのシード) から問題ごとのシード値を作る"""
+    material = f"{book_key}\x1f{item_id}\x1f{test_seed}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(material, digest_size=8).digest(), "big")
+
+
+def new_test_seed():
+    return random.SystemRandom().randrange(2**31)
+
+
+def shared_test_seed(book_hash, params):
+    """出題が乱数によらないとき（範囲の全部を順番通りに出すとき）に使うシード
+
+    (単語帳の内容ハッシュ, 設定) から決めるので、同じ条件ならどのセッションでも同じテスト
+    （4択の選択肢も同じ）になり、PDF キャッシュを共有できる。
+    """
+    material = json.dumps([book_hash, params], ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(material, digest_size=8).digest(), "big") & 0x7FFFFFFF
+
+
+STRATIFY_MODES = ("品詞", "ID帯")
+ID_BUCKETS = 10  # 「ID帯」の層の数（範囲内の位置で等分する）
+
+
+def variant_rng(seed, variant=0):
+    """(テストのシード, バージョン番号) ごとの乱数生成器"""
+    return np.random.default_rng([seed, variant])
+
+
+def variant_seed(seed, variant):
+    """バージョンごとの選択肢のシード（QuestionEngine 用。1 通り目はテストのシードそのまま）"""
+    if variant == 0:
+        return seed
+    return int(np.random.SeedSequence([seed, variant]).generate_state(1)[0] & 0x7FFFFFFF)
+
+
+def strata_for(target_df, stratify=None):
+    """層別抽出の層（行ごとのラベルの配列）。stratify が None なら None"""
+    if stratify is None:
+        return None
+    if stratify == "品詞":
+        return tag_pos(target_df)
+    if stratify == "ID帯":
+        return np.arange(len(target_df)) * ID_BUCKETS // max(len(target_df), 1)
+    raise ValueError(f"層の指定が違います: {stratify}")
+
+
+def allocate(counts, total):
+    """total 問を層の行数 counts に比例して割り振る（端数は余りの大きい層から 1 問ずつ）"""
+    counts = np.asarray(counts)
+    exact = counts * total / counts.sum()
+    quota = np.floor(exact).astype(np.int64)
+    rest = total - quota.sum()
+    if rest:
+        order = np.argsort(-(exact - quota), kind="stable")
+        quota[order[:rest]] += 1
+    return quota
+
+
+def stratum_groups(strata):
+    """層のラベルの配列を、層ごとの行の位置（昇順）の配列のリストにする（層は最初に出てくる順）"""
+    codes, _ = pd.factorize(np.asarray(strata))
+    order = np.argsort(codes, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(codes))[:-1])
+
+
+def sample_positions(n_rows, num_questions, rng, groups=None):
+    """出題する行の位置（0 始まり、昇順）を選ぶ
+
+    groups（stratum_groups の結果）を渡すと、層ごとの行数に比例して問題数を割り振り、
+    各層からその数だけ選ぶ。どちらも非復元抽出を 1 回ずつ行うだけで、行を 1 件ずつ見ない。
+    """
+    if num_questions >= n_rows:
+        return np.arange(n_rows)
+    if groups is None:
+        return np.sort(rng.choice(n_rows, num_questions, replace=False))
+    quota = allocate([len(group) for group in groups], num_questions)
+    picked = [group[rng.choice(len(group), q, replace=False)] for group, q in zip(groups, quota) if q]
+    return np.sort(np.concatenate(picked))
+
+
+def order_positions(target_df, order_mode, rng):
+    """並び順（target_df 内の位置の配列）。順番通りなら ID 順（複数の単語帳なら単語帳ごとに ID 順）"""
+    if order_mode == "ランダム":
+        return rng.permutation(len(target_df))
+    ids = target_df['id'].to_numpy()
+    if 'book_no' in target_df.columns:
+        return np.lexsort((ids, target_df['book_no'].to_numpy()))
+    return np.argsort(ids, kind="stable")
+
+
+def select_variants(target_df, num_questions, order_mode, seed, variants=1, stratify=None, same_questions=False):
+    """出題範囲の行からテストを variants 通り（A/B/C 版など）まとめて選ぶ
+
+    same_questions=True なら全バージョンで同じ問題を使い、並び順（ランダムのとき）だけを変える。
+    バージョン k の結果は、いつ何通り作っても同じになる。
+    """
+    strata = strata_for(target_df, stratify)
+    groups = stratum_groups(strata) if strata is not None else None
+    picked = None
+    selected = []
+    for variant in range(variants):
+        rng = variant_rng(seed, variant)
+        if picked is None or not same_questions:
+            picked = sample_positions(len(target_df), num_questions, rng, groups)
+        chosen = target_df.iloc[picked]
+        selected.append(chosen.iloc[order_positions(chosen, order_mode, rng)])
+    return selected
+
+
+def select_questions(target_df, num_questions, order_mode, seed, stratify=None):
+    """出題範囲の行から出題する行を選んで並べる（select_variants の 1 通り目）"""
+    return select_variants(target_df, num_questions, order_mode, seed, 1, stratify)[0]
+
+
+def select_review(ranked_df, num_questions, order_mode, seed):
+    """優先順に並んだ行（results.review_priority の結果）の先頭から選んで並べる"""
+    return order_questions(ranked_df.head(num_questions), order_mode, seed)
+
+
+def order_questions(target_df, order_mode, seed):
+    return target_df.iloc[order_positions(target_df, order_mode, variant_rng(seed))]
+
+
+class QuestionEngine:
+    """4択の選択肢と正解番号を決める
+
+    グローバルな random は触らず、問題ごとに random.Random を作るので、
+    同じ (単語帳, ID, シード) なら常に同じ並びになり、
+    複数セッションが同時に作成しても互いに影響しない。
+    similar（similar.SimilarityIndex）を渡すと、訳語の似ているものから誤答を選ぶ
+    （似た訳語が 3 つに満たないときは同じ品詞から選ぶ）。
+    """
+
+    def __init__(self, distractors, book_key, test_seed=0, similar=None):
+        self.distractors = distractors
+        self.book_key = book_key
+        self.test_seed = test_seed
+        self.similar = similar
+
+    def rng_for(self, item_id, book_key=None):
+        return random.Random(derive_seed(book_key or self.book_key, item_id, self.test_seed))
+
+    def choices_for(self, item):
+        """item（plan.QuestionRow）の (選択肢4つ, 正解番号 1～4) を返す"""
+        correct_ans = item.japanese
+        rng = self.rng_for(item.id, item.book)
+
+        near = self.similar.similar(correct_ans, SIMILAR_POOL) if self.similar is not None else []
+        if len(near) >= 3:
+            wrong_choices = rng.sample(near, 3)
+        elif self.distractors.candidate_count(correct_ans) < 3:
+            wrong_choices = self.distractors.sample_any(correct_ans, 3, rng)
+        else:
+            wrong_choices = self.distractors.sample_same_pos(correct_ans, 3, rng)
+
+        choices = wrong_choices + [correct_ans]
+        rng.shuffle(choices)
+        return choices, choices.index(correct_ans) + 1
+
+    def choices_for_page(self, items):
+        """1ページ分をまとめて決める"""
+        return [self.choices_for(item) for item in items]
@@ -0,0 +1,71 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class RangeError(ValueError):
+    """出題範囲の指定を解釈できないときのエラー"""
+
+
+def parse_ranges(text):
+    """ "1-50, 201-250" のような指定を [(1, 50), (201, 250)] にする（単独の番号も可）"""
+    ranges = []
+    for part in re.split(r"[,、，\s]+", text.strip()):
+        if not part:
+            continue
+        m = re.fullmatch(r"(\d+)(?:\s*[-～~ー－]\s*(\d+))?", part)
+        if m is None:
+            raise RangeError(f"範囲の指定を読み取れません: {part}")
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else start
+        if start > end:
+            raise RangeError(f"開始IDが終了IDより大きくなっています: {part}")
+        ranges.append((start, end))
+    return ranges
+
+
+def merge_ranges(ranges):
+    """重なる・隣り合う範囲をまとめて、開始ID順に並べる"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class IdRangeIndex:
+    """ID 順に並べた単語帳と、その ID 配列（範囲の検索は二分探索）
+
+    CSV がもともと ID 順なら並べ替えはせず、範囲はスライスで返す。
+    """
+
+    def __init__(self, df):
+        ids = df['id'].to_numpy()
+        if len(ids) > 1 and not (ids[1:] >= ids[:-1]).all():
+            order = np.argsort(ids, kind='stable')
+            df = df.iloc[order]
+            ids = ids[order]
+        self.df = df
+        self.ids = ids
+
+    def bounds(self, start_id, end_id):
+        """[start_id, end_id] に入る行の位置 (lo, hi)。df.iloc[lo:hi] がその範囲"""
+        lo = int(np.searchsorted(self.ids, start_id, side='left'))
+        hi = int(np.searchsorted(self.ids, end_id, side='right'))
+        return lo, max(lo, hi)
+
+    def count(self, ranges):
+        return sum(hi - lo for lo, hi in (self.bounds(s, e) for s, e in merge_ranges(ranges)))
+
+    def select(self, ranges):
+        """範囲内の行を ID 順で返す（範囲が 1 つならコピーしないスライス）"""
+        slices = [self.df.iloc[lo:hi] for lo, hi in (self.bounds(s, e) for s, e in merge_ranges(ranges))]
+        slices = [part for part in slices if len(part)]
+        if not slices:
+            return self.df.iloc[0:0]
+        if len(slices) == 1:
+            return slices[0]
+        return pd.concat(slices)
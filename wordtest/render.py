@@ -0,0 +1,388 @@
+import functools
+import io
+import threading
+import weakref
+import zipfile
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+from wordtest.plan import question_rows
+from wordtest.timing import span
+
+# --- フォント設定 ---
+# 登録は最初に PDF を作る（または文字幅を測る）ときにプロセスで一度だけ行う（ensure_fonts）
+JP_FONT_NAME = 'HeiseiMin-W3' # 明朝体
+JP_FONT_GOTHIC = 'HeiseiKakuGo-W5' # ゴシック体
+_fonts_ready = False
+_fonts_lock = threading.Lock()
+
+def ensure_fonts():
+    """日本語フォントを登録する（登録できなければ Helvetica で代用する）"""
+    global _fonts_ready, JP_FONT_NAME, JP_FONT_GOTHIC
+    if _fonts_ready:
+        return
+    with _fonts_lock:
+        if _fonts_ready:
+            return
+        try:
+            pdfmetrics.registerFont(UnicodeCIDFont('HeiseiMin-W3'))
+            pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
+        except:
+            JP_FONT_NAME = 'Helvetica'
+            JP_FONT_GOTHIC = 'Helvetica-Bold'
+        _fonts_ready = True
+
+EN_FONT_NAME = 'Times-Roman'
+
+# --- レイアウト設定 ---
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN_X = 5 * mm
+MARGIN_Y = 15 * mm
+COL_GAP = 6 * mm
+COLS = 2
+HEADER_HEIGHT = 35 * mm
+COL_WIDTH = (PAGE_WIDTH - (2 * MARGIN_X) - COL_GAP) / 2
+
+# 記述式の列幅（番号・単語・解答欄）
+W_ID = COL_WIDTH * 0.10
+W_WORD = COL_WIDTH * 0.45
+W_ANS = COL_WIDTH * 0.45
+
+FIT_CACHE_SIZE = 65536
+PREVIEW_PAGES = 2  # 大きなテストのプレビューに描くページ数（全ページは印刷ボタンから開く）
+PREVIEW_MAX_PAGES = 10  # これ以下のページ数のテストは、作った PDF をそのままプレビューに出す
+STREAM_PAGES = 40  # これより多いページのテストはメモリに持たず、ファイルに直接書き出す
+
+def rows_per_col(test_type):
+    return 25 if test_type == "記述式" else 10
+
+# --- ユーティリティ関数 ---
+def fit_text(text, font_name, max_width, max_size, min_size=6):
+    """枠に収まる (フォント名, 文字サイズ) を計算する（描画はしない）
+
+    同じ単語は何度も出題されるので、結果はプロセス全体で LRU キャッシュする。
+    lru_cache は min_size を省略した呼び出しと渡した呼び出しを別のキーにするので、
+    ここで引数を揃えてからキャッシュを引く（warm_fit_cache と描画で同じ値を使うため）。
+    """
+    return _fit_text(text, font_name, max_width, max_size, min_size)
+
+@functools.lru_cache(maxsize=FIT_CACHE_SIZE)
+def _fit_text(text, font_name, max_width, max_size, min_size):
+    ensure_fonts()
+    if font_name == EN_FONT_NAME:
+        if any(ord(char) > 127 for char in text):
+            font_name = JP_FONT_NAME 
+
+    current_size = max_size
+    try:
+        text_width = pdfmetrics.stringWidth(text, font_name, current_size)
+        if text_width > max_width:
+            ratio = max_width / text_width
+            new_size = current_size * ratio
+            if new_size < min_size:
+                new_size = min_size
+            current_size = new_size
+    except:
+        pass
+    return font_name, current_size
+
+fit_text.cache_clear = _fit_text.cache_clear
+fit_text.cache_info = _fit_text.cache_info
+
+def draw_fitted(canvases, text, x, y, max_width, font_name, max_size, min_size=6):
+    """一度だけ計測して、複数の canvas に同じ大きさで描画する"""
+    text = str(text)
+    font_name, size = fit_text(text, font_name, max_width, max_size, min_size)
+    for c in canvases:
+        c.setFont(font_name, size)
+        c.drawString(x, y, text)
+
+def draw_text_fitted(c, text, x, y, max_width, font_name, max_size, min_size=6):
+    """枠に合わせて文字サイズを自動縮小して描画（日本語混じり自動対応版）"""
+    draw_fitted((c,), text, x, y, max_width, font_name, max_size, min_size)
+
+def choice_word_width(id_width):
+    """4択式で英単語に使える幅（番号の幅を除く）"""
+    return COL_WIDTH - 25*mm - id_width 
+
+def warm_fit_cache(records):
+    """単語帳を読み込んだ時点で、描画時と同じ条件の計測を先に済ませておく（records は plan.question_rows の形）"""
+    ensure_fonts()
+    for item in records:
+        english = str(item.english)
+        japanese = str(item.japanese)
+        fit_text(english, EN_FONT_NAME, W_WORD - 4*mm, 11)
+        fit_text(japanese, JP_FONT_NAME, W_ANS - 4*mm, 9)
+        id_width = pdfmetrics.stringWidth(f"{item.id}.", JP_FONT_GOTHIC, 11)
+        fit_text(english, EN_FONT_NAME, choice_word_width(id_width), 13)
+
+_warmed_books = weakref.WeakSet()
+_warm_lock = threading.Lock()
+
+def warm_book_fits(book):
+    """warm_fit_cache を単語帳ごとに一度だけ実行する"""
+    with _warm_lock:
+        if book in _warmed_books:
+            return
+        _warmed_books.add(book)
+    warm_fit_cache(question_rows(book.df))
+
+# --- PDF作成関数 ---
+def create_pdf(plan, title, include_answers=False, code=None, answer_code=None):
+    """TestPlan を PDF に描画する（問題用紙・模範解答とも同じ plan から描く）"""
+    return render_sheets(plan, [(title, include_answers)], code=code, answer_code=answer_code)[0]
+
+def create_pdf_set(plan, title, answer_title, code=None, answer_code=None):
+    """問題用紙と模範解答を一度のループで作る（計測・レイアウト計算は共有）"""
+    problem, answer = render_sheets(plan, [(title, False), (answer_title, True)], code=code, answer_code=answer_code)
+    return problem, answer
+
+def zip_pdfs(files):
+    """{ファイル名: PDFバイト列} を 1 つの ZIP にまとめる"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+def zip_pdf_files(files, out):
+    """{ファイル名: PDFのパス} を out（書き込み用のファイル）に ZIP で書き出す（少しずつ読み書きする）"""
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, path in files.items():
+            zf.write(path, arcname=name)
+    return out
+
+def count_pages(plan):
+    items_per_page = COLS * rows_per_col(plan.test_type)
+    return (len(plan.items) + items_per_page - 1) // items_per_page
+
+def render_pages(plan, title, include_answers, pages, code=None, answer_code=None):
+    """指定したページ（0 始まり）だけの PDF を作る（プレビュー用）"""
+    return render_sheets(plan, [(title, include_answers)], pages=pages, code=code, answer_code=answer_code)[0]
+
+GRAY_BG = (0.96, 0.96, 0.96)
+
+QR_SIZE = 19 * mm
+
+def draw_qr(c, text, x, y, size):
+    """text の QR コードを (x, y) を左下として size 四方に描く"""
+    from reportlab.graphics import renderPDF
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+    from reportlab.graphics.shapes import Drawing
+
+    widget = QrCodeWidget(text, barBorder=0)
+    x0, y0, x1, y1 = widget.getBounds()
+    drawing = Drawing(size, size, transform=[size / (x1 - x0), 0, 0, size / (y1 - y0), 0, 0])
+    drawing.add(widget)
+    renderPDF.draw(drawing, c, x, y)
+
+def draw_header(c, title, code=None):
+    """ページ上部（タイトル・二重線・日付/氏名・SCORE 欄）。ページ番号は含まない
+
+    code（manifest.qr_payload の文字列）を渡すと、左側に QR コードとテスト ID を入れる。
+    """
+    width, height = PAGE_WIDTH, PAGE_HEIGHT
+    margin_x, margin_y = MARGIN_X, MARGIN_Y
+
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont(JP_FONT_GOTHIC, 18)
+    c.drawCentredString(width / 2, height - margin_y - 8*mm, title)
+    
+    line_y = height - margin_y - 12*mm
+    c.setLineWidth(1.0)
+    c.line(margin_x, line_y, width - margin_x, line_y)
+    c.setLineWidth(0.3)
+    c.line(margin_x, line_y - 1*mm, width - margin_x, line_y - 1*mm)
+
+    c.setFont(JP_FONT_NAME, 10)
+    info_y = height - margin_y - 22*mm
+    c.drawRightString(width - margin_x - 50*mm, info_y, "日付: ______ / ______   氏名: ______________________")
+    
+    score_box_w = 40 * mm
+    score_box_h = 14 * mm
+    score_box_x = width - margin_x - score_box_w
+    score_box_y = height - margin_y - 28*mm
+    
+    c.setLineWidth(1.2)
+    c.rect(score_box_x, score_box_y, score_box_w, score_box_h)
+    c.setFont(JP_FONT_GOTHIC, 11)
+    c.drawString(score_box_x + 2*mm, score_box_y + score_box_h - 5*mm, "SCORE")
+    c.setFont(EN_FONT_NAME, 16)
+    c.drawRightString(score_box_x + score_box_w - 5*mm, score_box_y + 3*mm, "/       ")
+
+    if code:
+        qr_y = height - margin_y - 14*mm - QR_SIZE
+        draw_qr(c, code, margin_x, qr_y, QR_SIZE)
+        c.setFillColorRGB(0, 0, 0)
+        c.setFont(EN_FONT_NAME, 7)
+        c.drawString(margin_x + QR_SIZE + 1*mm, qr_y, "ID " + code.split(":")[1])
+
+def row_origin(i, n_rows, row_height):
+    """ページ内 i 番目の問題の (x_base, y_base, text_y)"""
+    col_idx = i // n_rows
+    row_idx = i % n_rows
+    start_y = PAGE_HEIGHT - MARGIN_Y - HEADER_HEIGHT
+    x_base = MARGIN_X + col_idx * (COL_WIDTH + COL_GAP)
+    y_base = start_y - row_idx * row_height
+    text_y = y_base - row_height + (row_height / 2)
+    return x_base, y_base, text_y
+
+def draw_row_frames(c, test_type, n_items, row_height):
+    """問題 n_items 個分の枠（縞模様の背景・罫線・列の外枠）。文字は含まない"""
+    n_rows = rows_per_col(test_type)
+    c.setLineWidth(0.3)
+    for i in range(n_items):
+        x_base, y_base, _ = row_origin(i, n_rows, row_height)
+        if (i % n_rows) % 2 == 0:
+            c.setFillColorRGB(*GRAY_BG)
+            c.rect(x_base, y_base - row_height, COL_WIDTH, row_height, fill=1, stroke=0)
+            c.setFillColorRGB(0, 0, 0)
+
+        if test_type == "記述式":
+            c.setDash(1, 2)
+            c.setStrokeColorRGB(0.5, 0.5, 0.5)
+            c.line(x_base, y_base - row_height, x_base + COL_WIDTH, y_base - row_height)
+            c.setDash([])
+            c.setStrokeColorRGB(0, 0, 0)
+            c.setLineWidth(0.3)
+            c.line(x_base + W_ID, y_base, x_base + W_ID, y_base - row_height)
+            c.line(x_base + W_ID + W_WORD, y_base, x_base + W_ID + W_WORD, y_base - row_height)
+        else:
+            c.setLineWidth(0.3)
+            c.setStrokeColorRGB(0, 0, 0)
+            c.rect(x_base, y_base - row_height, COL_WIDTH, row_height)
+
+    if n_items:
+        start_y = PAGE_HEIGHT - MARGIN_Y - HEADER_HEIGHT
+        c.setLineWidth(1.0)
+        c.setStrokeColorRGB(0, 0, 0)
+        h_col1 = min(n_rows, n_items) * row_height
+        c.rect(MARGIN_X, start_y - h_col1, COL_WIDTH, h_col1)
+        if n_items > n_rows:
+            h_col2 = (n_items - n_rows) * row_height
+            c.rect(MARGIN_X + COL_WIDTH + COL_GAP, start_y - h_col2, COL_WIDTH, h_col2)
+
+def render_sheets(plan, sheets, pages=None, outputs=None, code=None, progress=None, answer_code=None):
+    """sheets: [(タイトル, 解答を書くか), ...] ごとに PDF を作り、BytesIO のリストで返す
+
+    pages を渡すとそのページだけを描く（ページ番号の表示は全体での番号のまま）。
+    outputs に書き込み用に開いたファイルを渡すと、BytesIO の代わりにそこへ書き出して
+    outputs をそのまま返す（大きなテストで PDF 全体のコピーをメモリに持たないため）。
+    code を渡すとヘッダーに QR コードを入れる（draw_header）。answer_code を渡すと、解答を書く
+    sheet にはそちらを入れる（正解番号入りの QR コードは模範解答にだけ入れる。manifest.qr_codes）。
+    progress を渡すと 1 ページ描くごとに progress(描いたページ数, 全ページ数) を呼ぶ。
+
+    ヘッダーと問題の枠（背景・罫線）はどのページも同じなので、PDF ごとに一度だけ
+    フォーム XObject として描き、各ページではそれを貼ってから文字だけを描く。
+    途中で終わる最後のページの枠だけは直接描く。
+    """
+    ensure_fonts()
+    target_data = plan.items
+    test_type = plan.test_type
+
+    buffers = list(outputs) if outputs is not None else [io.BytesIO() for _ in sheets]
+    canvases = [canvas.Canvas(buffer, pagesize=A4) for buffer in buffers]
+    answer_canvases = [c for c, (_, include_answers) in zip(canvases, sheets) if include_answers]
+    
+    n_rows = rows_per_col(test_type)
+    items_per_page = COLS * n_rows
+    body_height = PAGE_HEIGHT - (2 * MARGIN_Y) - HEADER_HEIGHT
+    row_height = body_height / n_rows
+
+    total_pages = (len(target_data) + items_per_page - 1) // items_per_page
+    if pages is None:
+        pages = range(total_pages)
+    else:
+        pages = [page for page in pages if 0 <= page < total_pages]
+
+    # 各ページ共通の部分をフォームにしておく（ページの描画を始める前に定義する）
+    has_full_page = any((page + 1) * items_per_page <= len(target_data) for page in pages)
+    for c, (title, include_answers) in zip(canvases, sheets):
+        c.beginForm("header")
+        draw_header(c, title, answer_code if include_answers and answer_code else code)
+        c.endForm()
+        if has_full_page:
+            c.beginForm("rows")
+            draw_row_frames(c, test_type, items_per_page, row_height)
+            c.endForm()
+
+    with span("render.draw"):
+        for done, page in enumerate(pages, start=1):
+            page_data = target_data[page * items_per_page : (page + 1) * items_per_page]
+
+            for c in canvases:
+                c.doForm("header")
+                if len(page_data) == items_per_page:
+                    c.doForm("rows")
+                else:
+                    draw_row_frames(c, test_type, len(page_data), row_height)
+                c.setFillColorRGB(0, 0, 0)
+                c.setFont(EN_FONT_NAME, 9)
+                c.drawRightString(PAGE_WIDTH - MARGIN_X, 8 * mm, f"- {page + 1} -")
+
+            for i, item in enumerate(page_data):
+                x_base, y_base, text_y = row_origin(i, n_rows, row_height)
+
+                if test_type == "記述式":
+                    for c in canvases:
+                        c.setFont(JP_FONT_GOTHIC, 9)
+                        c.drawCentredString(x_base + (W_ID / 2), text_y - 2, str(item.id))
+                
+                    draw_fitted(canvases, str(item.english), x_base + W_ID + 2*mm, text_y - 2, W_WORD - 4*mm, EN_FONT_NAME, 11)
+                    if answer_canvases:
+                        draw_fitted(answer_canvases, str(item.japanese), x_base + W_ID + W_WORD + 2*mm, text_y - 2, W_ANS - 4*mm, JP_FONT_NAME, 9)
+
+                else:
+                    choices, correct_num = item.choices, item.answer
+
+                    line_1_y = y_base - 13
+                    line_2_y = y_base - 32
+                    line_3_y = y_base - 48
+                
+                    id_str = f"{item.id}."
+                    id_width = pdfmetrics.stringWidth(id_str, JP_FONT_GOTHIC, 11)
+                    for c in canvases:
+                        c.setFont(JP_FONT_GOTHIC, 11)
+                        c.drawString(x_base + 3*mm, line_1_y, id_str)
+                
+                    max_word_width = choice_word_width(id_width)
+                
+                    draw_fitted(canvases, str(item.english), x_base + 4*mm + id_width, line_1_y, max_word_width, EN_FONT_NAME, 13)
+                
+                    for c in canvases:
+                        c.setFont(EN_FONT_NAME, 12)
+                        c.drawRightString(x_base + COL_WIDTH - 5*mm, line_1_y, "(       )")
+                
+                    for c in answer_canvases:
+                        c.setFont(JP_FONT_GOTHIC, 11)
+                        c.drawCentredString(x_base + COL_WIDTH - 10*mm, line_1_y, str(correct_num))
+                
+                    labels = []
+                    for idx, txt in enumerate(choices, start=1):
+                        label = f"{idx}. {txt}"
+                        if len(label) > 18: label = label[:17] + ".."
+                        labels.append(label)
+
+                    for c in canvases:
+                        c.setFont(JP_FONT_NAME, 9)
+                        c.setFillColorRGB(0, 0, 0)
+                        c.drawString(x_base + 5*mm, line_2_y, labels[0])
+                        c.drawString(x_base + (COL_WIDTH/2) + 2*mm, line_2_y, labels[1])
+                        c.drawString(x_base + 5*mm, line_3_y, labels[2])
+                        c.drawString(x_base + (COL_WIDTH/2) + 2*mm, line_3_y, labels[3])
+
+            for c in canvases:
+                c.showPage()
+            if progress is not None:
+                progress(done, len(pages))
+
+    with span("render.save"):
+        for c, buffer in zip(canvases, buffers):
+            c.save()
+            if outputs is None:
+                buffer.seek(0)
+    return buffers
@@ -0,0 +1,67 @@
+"""プロセスで一度だけ用意する重いもの（PDF ライブラリ・フォント・PDF ビューア）
+
+Streamlit は操作のたびに app.py を実行し直すが、モジュールの読み込みはプロセスで一度きり。
+ReportLab と streamlit_pdf_viewer は PDF を実際に作るまで読み込まないので、
+起動直後のサイドバー表示はそれらを待たない。単語帳を開いたときの温め（warm_in_background）も、
+ReportLab を使う文字幅の計測は最初に PDF を作るまで後回しにする。
+"""
+import importlib
+import sys
+import threading
+import weakref
+
+from wordtest import similar
+
+_warming = weakref.WeakSet()
+_warming_lock = threading.Lock()
+_fits_pending = weakref.WeakSet()  # 文字幅の計測の温めを、PDF ライブラリを読み込むまで待っている単語帳
+
+
+def renderer():
+    """wordtest.render を読み込み、フォントを登録して返す
+
+    それまでに開いた単語帳の文字幅の計測の温めは、ここで（別スレッドで）始める。
+    """
+    render = importlib.import_module("wordtest.render")
+    render.ensure_fonts()
+    with _warming_lock:
+        pending = list(_fits_pending)
+        _fits_pending.clear()
+    if pending:
+        threading.Thread(target=_warm_fits, args=(render, pending), daemon=True).start()
+    return render
+
+
+def pdf_viewer():
+    return importlib.import_module("streamlit_pdf_viewer").pdf_viewer
+
+
+def warm_in_background(book):
+    """「似た訳語」の索引と文字幅の計測キャッシュを別スレッドで温める（単語帳ごとに一度だけ）
+
+    サイドバーの表示を待たせずに、作成ボタンを押すまでに済ませておく。文字幅の計測は
+    ReportLab を読み込むので、PDF ライブラリがまだ読み込まれていなければ最初の作成
+    （renderer の初回）まで待つ。その単語帳の最初のテストは温めなしで描くことになる。
+    """
+    with _warming_lock:
+        if book in _warming:
+            return None
+        _warming.add(book)
+        fits = "wordtest.render" in sys.modules
+        if not fits:
+            _fits_pending.add(book)
+    thread = threading.Thread(target=_warm, args=(book, fits), daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm(book, fits):
+    if fits:
+        renderer().warm_book_fits(book)
+    # 「似た訳語」の近傍も前計算してディスクに残す（大きな単語帳は使う分だけその場で計算する）
+    similar.warm(book.similar, book.content_hash)
+
+
+def _warm_fits(render, books):
+    for book in books:
+        render.warm_book_fits(book)
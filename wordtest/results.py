@@ -0,0 +1,163 @@
+"""採点結果の記録（SQLite）と、SM-2 方式の復習スケジュール
+
+attempts には 1 問ごとの結果をすべて残し、schedule には (生徒, 単語帳, ID) ごとの
+最新の状態だけを持つ。記録のたびに該当する行だけを更新するので、出題の選択は
+履歴の量によらず schedule の主キー（範囲検索）だけで済む。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_DB = os.environ.get("WORDTEST_RESULTS_DB", "results.sqlite3")
+DAY = 24 * 60 * 60
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    learner   TEXT    NOT NULL,
+    book      TEXT    NOT NULL,
+    word_id   INTEGER NOT NULL,
+    correct   INTEGER NOT NULL,
+    tested_at REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_word ON attempts (learner, book, word_id, tested_at);
+CREATE TABLE IF NOT EXISTS schedule (
+    learner     TEXT    NOT NULL,
+    book        TEXT    NOT NULL,
+    word_id     INTEGER NOT NULL,
+    reps        INTEGER NOT NULL,
+    lapses      INTEGER NOT NULL,
+    ease        REAL    NOT NULL,
+    interval    REAL    NOT NULL,
+    last_tested REAL    NOT NULL,
+    due         REAL    NOT NULL,
+    PRIMARY KEY (learner, book, word_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS schedule_due ON schedule (learner, book, due);
+"""
+
+
+def sm2_step(reps, lapses, ease, interval, correct):
+    """1 回分の結果で (reps, lapses, ease, interval[日]) を更新する
+
+    正解は品質 4、不正解は品質 1 として SM-2 の式に当てはめる。
+    """
+    quality = 4 if correct else 1
+    if correct:
+        interval = 1.0 if reps == 0 else 6.0 if reps == 1 else interval * ease
+        reps += 1
+    else:
+        reps = 0
+        lapses += 1
+        interval = 1.0
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return reps, lapses, ease, interval
+
+
+class ResultStore:
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Streamlit はセッションごとにスレッドが違うので、接続は操作のたびに開く
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, learner, results, tested_at=None):
+        """results: [(単語帳キー, ID, 正解したか), ...] を記録し、スケジュールを更新する"""
+        tested_at = time.time() if tested_at is None else tested_at
+        results = [(book, int(word_id), bool(correct)) for book, word_id, correct in results]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO attempts (learner, book, word_id, correct, tested_at) VALUES (?, ?, ?, ?, ?)",
+                    [(learner, book, word_id, int(correct), tested_at) for book, word_id, correct in results])
+                for book, word_id, correct in results:
+                    row = conn.execute(
+                        "SELECT reps, lapses, ease, interval FROM schedule WHERE learner = ? AND book = ? AND word_id = ?",
+                        (learner, book, word_id)).fetchone()
+                    reps, lapses, ease, interval = sm2_step(*(row or (0, 0, INITIAL_EASE, 0.0)), correct)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO schedule VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (learner, book, word_id, reps, lapses, ease, interval, tested_at, tested_at + interval * DAY))
+        finally:
+            conn.close()
+        return len(results)
+
+    def schedule(self, learner, book, ranges):
+        """ranges 内の単語の復習状態（word_id, reps, lapses, interval, due）。未出題の単語は含まない"""
+        conn = self._connect()
+        try:
+            rows = []
+            for start, end in ranges:
+                rows.extend(conn.execute(
+                    "SELECT word_id, reps, lapses, interval, due FROM schedule"
+                    " WHERE learner = ? AND book = ? AND word_id BETWEEN ? AND ?",
+                    (learner, book, int(start), int(end))).fetchall())
+        finally:
+            conn.close()
+        return pd.DataFrame(rows, columns=["word_id", "reps", "lapses", "interval", "due"]).drop_duplicates("word_id")
+
+    def due_count(self, learner, book, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM schedule WHERE learner = ? AND book = ? AND due <= ?",
+                                (learner, book, now)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def learners(self):
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT learner FROM schedule ORDER BY learner")]
+        finally:
+            conn.close()
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def default_store():
+    """WORDTEST_RESULTS_DB（既定は results.sqlite3）の ResultStore。最初に使うときに作る"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ResultStore()
+        return _default_store
+
+
+def review_priority(candidates, schedules, default_book, now=None):
+    """出題候補に優先順位をつけて並べ替える（先頭ほど優先）
+
+    schedules: 単語帳キー → ResultStore.schedule の結果。candidates に book 列がなければ
+    すべて default_book の単語として扱う。
+    期限切れの単語（期限からの経過が復習間隔に比べて長いほど先、同じなら間違えた回数が多いほど先）、
+    まだ出題していない単語、期限前の単語（期限が近い順）の順に並べる。
+    """
+    now = time.time() if now is None else now
+    books = candidates['book'] if 'book' in candidates.columns else pd.Series(default_book, index=candidates.index)
+    frames = [df.assign(book=book) for book, df in schedules.items() if len(df)]
+    state = pd.concat(frames) if frames else pd.DataFrame(columns=["word_id", "reps", "lapses", "interval", "due", "book"])
+
+    keys = pd.MultiIndex.from_arrays([books.to_numpy(), candidates['id'].to_numpy()])
+    state = state.set_index(['book', 'word_id']).reindex(keys)
+    tested = state['due'].notna().to_numpy()
+    overdue = ((now - state['due']) / (state['interval'] * DAY)).fillna(0).to_numpy(dtype=float)
+    group = np.ones(len(candidates), dtype=np.int8)  # 0: 期限切れ, 1: 未出題, 2: 期限前
+    group[tested & (overdue >= 0)] = 0
+    group[tested & (overdue < 0)] = 2
+    lapses = state['lapses'].fillna(0).to_numpy(dtype=float)
+    # np.lexsort は最後のキーが第 1 キー（同順位は元の並び＝ID 順のまま）
+    order = np.lexsort((np.arange(len(candidates)), -lapses, -overdue, group))
+    return candidates.iloc[order]
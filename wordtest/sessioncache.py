@@ -0,0 +1,60 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_SESSION_BYTES = int(os.environ.get("WORDTEST_SESSION_CACHE_BYTES", 32 * 1024 * 1024))
+DEFAULT_SESSION_ENTRIES = 16
+
+
+class SessionCache:
+    """1 セッション分の作成結果（出題・TestPlan・PDF）の LRU
+
+    範囲や単語帳を行き来しても、前に作ったテストを同じ中身のまま描き直さずに出せるようにする。
+    値の大きさは呼び出し側が見積もって渡し、合計が max_bytes を超えたら古いものから捨てる。
+    触るのはそのセッションのスクリプトの実行（描画待ちのフラグメントを含む）だけで、
+    Streamlit はそれを同時には走らせない。ロックは、後で別のスレッドから触るようになっても
+    中身が壊れないための念のためのもの（取るのは短い間だけなので、ほぼ負担にならない）。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_SESSION_BYTES, max_entries=DEFAULT_SESSION_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # キー → (値, 大きさ)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def drop(self, predicate):
+        """predicate(キー) が真のものを捨てる（記録した結果で中身が変わる出題など）"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                _, size = self._entries.pop(key)
+                self._size -= size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
@@ -0,0 +1,246 @@
+"""訳語どうしの似ている度合いの索引（4択の「似た訳語」の誤答用）
+
+    python -m wordtest.similar 単語data/*.csv     # 全訳語の近傍を前計算してディスクに保存
+
+訳語（と、その訳語を持つ最初の行の英語）を文字 n-gram の TF-IDF ベクトルにして、
+コサイン類似度の上位 TOP_K 件を近傍として持つ。ネットワークも GPU も使わない。
+
+近傍は単語帳の内容ハッシュごとに SIMILAR_DIR へ .npz で保存する。保存がなければ
+n-gram の転置索引を作り、聞かれた訳語の分だけその場で計算する（1 問あたり 1ms 程度）。
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from wordtest.distractors import tag_pos
+
+SIMILAR_DIR = os.environ.get("WORDTEST_SIMILAR_DIR", "similar_cache")
+VERSION = 2  # 2: 同じ品詞の訳語を先に並べる
+TOP_K = 16
+MAX_SIMILARITY = 0.8  # これ以上似ている訳語は言い換え（どちらも正解）の恐れがあるので誤答にしない
+MAX_POSTINGS = 2000   # これより多くの訳語に現れる n-gram（「る」など）は近傍の計算に使わない
+WARM_LIMIT = 20000    # 起動時の温め（warm）で前計算まで済ませる訳語数の上限
+ENGLISH_WEIGHT = 0.5  # 英語のつづりの似かたは訳語の似かたより軽く見る
+
+_STRIP = re.compile(r"[\s～〜~…・、。,.;；:：()（）\[\]［］〔〕「」『』]+")
+_KANJI = re.compile(r"[\u4e00-\u9fff々]")
+
+
+def ja_grams(text):
+    """訳語の文字 1-gram と 2-gram（記号と空白は除く）"""
+    text = _STRIP.sub("", str(text))
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def en_grams(text):
+    """英語の文字 3-gram（語頭・語末の目印つき）。訳語の n-gram と混ざらないよう "e:" をつける"""
+    grams = set()
+    for word in str(text).lower().split():
+        word = f" {word} "
+        grams.update("e:" + word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def _top(scores, n):
+    """scores の大きい順に最大 n 件の番号"""
+    n = min(n, len(scores))
+    top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class SimilarityIndex:
+    """meanings（重複なし）ごとに似ている訳語の上位 TOP_K 件を引く索引
+
+    neighbors[i] は meanings[i] の近傍の番号（足りない分は -1）。
+    done[i] が偽の行はまだ計算していない（similar を呼んだときに計算する）。
+    pos（品詞タグ）を渡すと、同じ品詞の訳語を似ている順に先に並べ、足りない分だけ
+    他の品詞の訳語を似ている順に続ける（品詞で見分けられる誤答にしないため）。
+    同じ品詞で漢字を共有する訳語（「決める」と「決定する」など、言い換えの恐れがあるもの）は外す。
+    """
+
+    def __init__(self, meanings, english=None, pos=None, neighbors=None):
+        self.meanings = list(meanings)
+        self.english = list(english) if english is not None else [""] * len(self.meanings)
+        self.pos = list(pos) if pos is not None else [None] * len(self.meanings)
+        self._pos_codes = pd.factorize(pd.Series(self.pos, dtype=object))[0] if pos is not None else None
+        self._where = {m: i for i, m in enumerate(self.meanings)}
+        n = len(self.meanings)
+        if neighbors is None:
+            self.neighbors = np.full((n, TOP_K), -1, dtype=np.int32)
+            self.done = np.zeros(n, dtype=bool)
+        else:
+            self.neighbors = neighbors
+            self.done = np.ones(n, dtype=bool)
+        self._postings = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_df(cls, df):
+        """訳語は出現順に重複を除き、英語はその訳語を持つ最初の行のものを使う"""
+        first = df.dropna(subset=['japanese']).drop_duplicates('japanese')
+        return cls(first['japanese'].tolist(), first['english'].fillna("").astype(str).tolist(), tag_pos(first))
+
+    def __len__(self):
+        return len(self.meanings)
+
+    def _build_postings(self):
+        """n-gram → (訳語の番号, 重み) の転置索引と、訳語ごとの n-gram の並びを作る"""
+        gram_ids = {}
+        rows, cols = [], []
+        for i, (meaning, english) in enumerate(zip(self.meanings, self.english)):
+            for gram in ja_grams(meaning) | en_grams(english):
+                rows.append(i)
+                cols.append(gram_ids.setdefault(gram, len(gram_ids)))
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        n_grams = len(gram_ids)
+
+        df = np.bincount(cols, minlength=n_grams)
+        idf = np.log((len(self.meanings) + 1) / (df + 1)) + 1
+        idf[[gram_id for gram, gram_id in gram_ids.items() if gram.startswith("e:")]] *= ENGLISH_WEIGHT
+        weights = idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(self.meanings)))
+        values = weights / norms[rows]
+
+        # 訳語ごとの n-gram（rows は昇順に並んでいる）
+        doc_ptr = np.zeros(len(self.meanings) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.meanings)), out=doc_ptr[1:])
+        # n-gram ごとの訳語
+        order = np.argsort(cols, kind="stable")
+        gram_ptr = np.zeros(n_grams + 1, dtype=np.int64)
+        np.cumsum(df, out=gram_ptr[1:])
+        return {
+            "doc_ptr": doc_ptr, "doc_grams": cols, "doc_values": values,
+            "gram_ptr": gram_ptr, "gram_docs": rows[order], "gram_values": values[order],
+        }
+
+    def _compute(self, i):
+        p = self._postings
+        grams = p["doc_grams"][p["doc_ptr"][i]:p["doc_ptr"][i + 1]]
+        weights = p["doc_values"][p["doc_ptr"][i]:p["doc_ptr"][i + 1]]
+        starts, ends = p["gram_ptr"][grams], p["gram_ptr"][grams + 1]
+        keep = (ends - starts) <= MAX_POSTINGS
+        if not keep.any():
+            return
+        docs = np.concatenate([p["gram_docs"][s:e] for s, e in zip(starts[keep], ends[keep])])
+        values = np.concatenate([p["gram_values"][s:e] for s, e in zip(starts[keep], ends[keep])])
+        values = values * np.repeat(weights[keep], (ends - starts)[keep])
+        scores = np.bincount(docs, weights=values, minlength=len(self.meanings))
+        scores[i] = 0.0
+        scores[scores >= MAX_SIMILARITY] = 0.0
+
+        if self._pos_codes is None:
+            top = _top(scores, 4 * TOP_K)
+        else:
+            same = self._pos_codes == self._pos_codes[i]
+            top = np.concatenate([_top(np.where(same, scores, 0.0), 4 * TOP_K),
+                                  _top(np.where(same, 0.0, scores), 4 * TOP_K)])
+        meaning = _STRIP.sub("", str(self.meanings[i]))
+        kanji = set(_KANJI.findall(meaning))
+        picked = []
+        for j in top:
+            if len(picked) == TOP_K:
+                break
+            if scores[j] <= 0:
+                continue
+            other = _STRIP.sub("", str(self.meanings[j]))
+            # 「調べる」と「～を調べる」のように一方が他方を含むものは言い換えとみなす
+            if other and meaning and (other in meaning or meaning in other):
+                continue
+            if self.pos[i] is not None and self.pos[j] == self.pos[i] and kanji.intersection(other):
+                continue
+            picked.append(j)
+        self.neighbors[i, :len(picked)] = picked
+
+    def _ensure(self, rows):
+        with self._lock:
+            rows = [i for i in rows if not self.done[i]]
+            if not rows:
+                return
+            if self._postings is None:
+                self._postings = self._build_postings()
+            for i in rows:
+                self._compute(i)
+                self.done[i] = True
+
+    def similar(self, meaning, k=TOP_K):
+        """meaning に似ている訳語（似ている順に最大 k 件、meaning 自身と言い換えは除く）"""
+        i = self._where.get(meaning)
+        if i is None:
+            return []
+        if not self.done[i]:
+            self._ensure([i])
+        return [self.meanings[j] for j in self.neighbors[i, :k] if j >= 0]
+
+    def precompute(self):
+        """全訳語の近傍を計算する（保存する前に呼ぶ）"""
+        self._ensure(range(len(self.meanings)))
+        self._postings = None  # 全部済めば転置索引はいらない
+        return self
+
+
+def cache_path(content_hash, similar_dir=SIMILAR_DIR):
+    return os.path.join(similar_dir, f"{content_hash[:32]}.npz")
+
+
+def save_index(index, content_hash, similar_dir=SIMILAR_DIR):
+    """前計算した索引を保存する（訳語の並びも入れ、読み込み時に照合する）"""
+    index.precompute()
+    os.makedirs(similar_dir, exist_ok=True)
+    path = cache_path(content_hash, similar_dir)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, version=VERSION, top_k=TOP_K, neighbors=index.neighbors,
+             meanings=np.array(index.meanings, dtype=object).astype(str))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(df, content_hash, similar_dir=SIMILAR_DIR):
+    """保存済みの索引があれば読み込み、なければ（近傍は未計算の）索引を作る"""
+    index = SimilarityIndex.from_df(df)
+    path = cache_path(content_hash, similar_dir)
+    try:
+        with np.load(path) as saved:
+            if (int(saved["version"]) == VERSION and int(saved["top_k"]) == TOP_K
+                    and saved["meanings"].tolist() == index.meanings):
+                index.neighbors = saved["neighbors"]
+                index.done[:] = True
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    return index
+
+
+def warm(index, content_hash, similar_dir=SIMILAR_DIR):
+    """小さな単語帳は前計算して保存しておく（resources.warm_in_background から呼ぶ）"""
+    if len(index) <= WARM_LIMIT and not index.done.all():
+        save_index(index, content_hash, similar_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("books", nargs="+", help="単語帳（CSV / .wbk）")
+    parser.add_argument("--out", default=SIMILAR_DIR, help="保存先のフォルダ")
+    args = parser.parse_args(argv)
+
+    from wordtest.wordbook import WordBookError, read_wordbook
+    failed = 0
+    for path in args.books:
+        try:
+            book = read_wordbook(path)
+        except WordBookError as e:
+            failed += 1
+            print(f"{path}: {e}", file=sys.stderr)
+            continue
+        index = SimilarityIndex.from_df(book.df)
+        out = save_index(index, book.content_hash, args.out)
+        print(f"{path} → {out}（{len(index)}語）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""1 リクエスト（Streamlit の 1 回の実行）ごとの処理時間の内訳
+
+    timer = timing.start("rerun", file="...")
+    with timing.span("load_data"):
+        ...
+    timing.finish(timer)   # WORDTEST_TIMING_LOG があれば JSON 1 行を追記する
+
+span は今のタイマー（contextvars）に記録するので、wordtest 内の関数からも引数を
+増やさずに使える。タイマーがないとき（バッチ・ベンチマーク）は何もしない。
+"""
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import uuid
+
+TIMING_LOG = os.environ.get("WORDTEST_TIMING_LOG")
+PROFILE_DIR = os.environ.get("WORDTEST_PROFILE_DIR", "profiles")
+
+logger = logging.getLogger("wordtest.timing")
+_current = contextvars.ContextVar("wordtest_timer", default=None)
+
+
+class RequestTimer:
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.request_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.spans = []
+        self.total = None
+        self._start = time.perf_counter()
+        self._depth = 0
+        self._token = None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        entry = {"name": name, "depth": self._depth, "start_ms": round((time.perf_counter() - self._start) * 1000, 3)}
+        self.spans.append(entry)
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._depth -= 1
+
+    def merge(self, name, other, **fields):
+        """別のスレッドで計測し終えた other の span を、name の span の下にまとめて足す
+
+        スレッドをまたいでタイマーを共有しないため、描画ジョブは自分のタイマーに記録し、
+        結果を受け取った実行がここで自分のタイマーに写す（開始時刻は other のものなので入れない）。
+        """
+        self.spans.append({"name": name, "depth": self._depth, "ms": other.total, **fields})
+        for entry in other.spans:
+            copied = {key: value for key, value in entry.items() if key != "start_ms"}
+            copied["depth"] = entry["depth"] + self._depth + 1
+            self.spans.append(copied)
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "time": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "total_ms": self.total,
+            **self.fields,
+            "spans": self.spans,
+        }
+
+
+def start(name, **fields):
+    """タイマーを作って「今のタイマー」にする"""
+    timer = RequestTimer(name, **fields)
+    timer._token = _current.set(timer)
+    return timer
+
+
+def finish(timer):
+    """計測を終えて、WORDTEST_TIMING_LOG（または logging の設定）に JSON で出す"""
+    timer.total = round((time.perf_counter() - timer._start) * 1000, 3)
+    if timer._token is not None:
+        try:
+            _current.reset(timer._token)
+        except ValueError:  # 別のコンテキストで start した場合
+            _current.set(None)
+        timer._token = None
+    logger.info(json.dumps(timer.to_dict(), ensure_ascii=False))
+    return timer
+
+
+@contextlib.contextmanager
+def recording(timer):
+    """このスレッドの span を timer に記録する（ログには出さない。終わると total が入る）"""
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        timer.total = round((time.perf_counter() - timer._start) * 1000, 3)
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name):
+    timer = _current.get()
+    if timer is None:
+        yield None
+        return
+    with timer.span(name) as entry:
+        yield entry
+
+
+class ProfileCapture:
+    """cProfile を 1 リクエスト分だけ動かし、.prof ファイルと上位の関数の一覧を残す"""
+
+    def __init__(self, profile_dir=PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self.path = None
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+        return self
+
+    def stop(self, top=25):
+        """止めて .prof を保存し、累積時間の上位 top 件を文字列で返す"""
+        self._profile.disable()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.path = os.path.join(self.profile_dir, datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f") + ".prof")
+        self._profile.dump_stats(self.path)
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(top)
+        return out.getvalue()
+
+
+def _configure_log(path):
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+if TIMING_LOG:
+    _configure_log(TIMING_LOG)
@@ -0,0 +1,188 @@
+import glob
+import hashlib
+import io
+import os
+import threading
+
+import pandas as pd
+
+from wordtest.compiled import EXTENSION, CompiledBook
+from wordtest.distractors import DistractorIndex, tag_pos
+from wordtest.similar import load_index
+from wordtest.ranges import IdRangeIndex
+
+REQUIRED_COLS = {'id', 'english', 'japanese'}
+
+
+class WordBookError(ValueError):
+    """単語帳ファイルを読み込めない・必要な列がないときのエラー"""
+
+
+class WordBook:
+    """読み込み済みの単語帳 1 冊分（ファイルの mtime/size と一緒に保持）"""
+
+    def __init__(self, path, df, signature, content_hash, row_pos=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.key = os.path.splitext(self.name)[0]  # CSV と .wbk で共通の名前（出題のシードに使う）
+        self.df = df
+        self.signature = signature
+        self.content_hash = content_hash  # ファイル内容の sha256（PDF キャッシュのキーに使う）
+        self._pos_tags = row_pos  # 行ごとの品詞タグ（.wbk に保存済みのときは最初から入っている）
+        self._lock = threading.Lock()
+        self._distractors = None
+        self._similar = None
+        self._id_index = None
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def pos_tags(self):
+        """行ごとの品詞タグ（CSV の pos 列があれば優先、なければ訳語から推定。初回に一度だけ求める）"""
+        if self._pos_tags is None:
+            with self._lock:
+                if self._pos_tags is None:
+                    self._pos_tags = tag_pos(self.df)
+        return self._pos_tags
+
+    @property
+    def distractors(self):
+        """4択用の誤答索引（初回アクセス時に一度だけ作る）"""
+        if self._distractors is None:
+            pos_tags = self.pos_tags
+            with self._lock:
+                if self._distractors is None:
+                    self._distractors = DistractorIndex.from_df(self.df, pos_tags)
+        return self._distractors
+
+    @property
+    def similar(self):
+        """「似た訳語」の誤答用の索引（初回アクセス時に、保存済みの前計算があれば読み込む）"""
+        if self._similar is None:
+            with self._lock:
+                if self._similar is None:
+                    self._similar = load_index(self.df, self.content_hash)
+        return self._similar
+
+    @property
+    def id_index(self):
+        """出題範囲の検索用に ID 順に並べた索引（初回アクセス時に一度だけ作る）"""
+        if self._id_index is None:
+            with self._lock:
+                if self._id_index is None:
+                    self._id_index = IdRangeIndex(self.df)
+        return self._id_index
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_wordbook(path):
+    """CSV（または .wbk）を読み込み、列チェックをして WordBook を返す（キャッシュなし）"""
+    signature = _file_signature(path)
+    if path.endswith(EXTENSION):
+        try:
+            compiled = CompiledBook(path)
+            df = compiled.to_df()
+        except Exception as e:
+            raise WordBookError(f"読み込みエラー: {e}") from e
+        # 内容ハッシュは変換元のものを使い、CSV から読んだ場合と PDF キャッシュを共有する
+        return WordBook(path, df, signature, compiled.header["source_hash"], compiled.pos_tags())
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        df = pd.read_csv(io.BytesIO(raw))
+    except Exception as e:
+        raise WordBookError(f"読み込みエラー: {e}") from e
+    if not REQUIRED_COLS.issubset(df.columns):
+        raise WordBookError(f"エラー: {os.path.basename(path)} に必要な列が含まれていません。")
+    return WordBook(path, df, signature, hashlib.sha256(raw).hexdigest())
+
+
+def _prefer_compiled(csv_files, compiled_files):
+    """同じ名前の .wbk が CSV 以降に作られていれば、CSV の代わりに .wbk を使う"""
+    compiled = {os.path.splitext(p)[0]: p for p in compiled_files}
+    files = []
+    watched = []
+    for path in csv_files:
+        wbk = compiled.pop(os.path.splitext(path)[0], None)
+        if wbk is None:
+            files.append(path)
+            continue
+        watched.extend([path, wbk])
+        files.append(wbk if os.stat(wbk).st_mtime_ns >= os.stat(path).st_mtime_ns else path)
+    # CSV のない .wbk（raw.txt から変換したものなど）もそのまま一覧に出す
+    files.extend(compiled.values())
+    return files, watched
+
+
+def _stamps(paths):
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            stamps.append(None)
+    return stamps
+
+
+class WordBookCache:
+    """プロセス全体で共有する単語帳キャッシュ
+
+    ファイルごとに (mtime, size) を覚えておき、変わっていなければ
+    読み込み済みの WordBook をそのまま返す。フォルダ一覧もフォルダの
+    mtime が変わったときだけ取り直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books = {}
+        self._listings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def list_files(self, data_dir):
+        if not os.path.isdir(data_dir):
+            return []
+        dir_mtime = os.stat(data_dir).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(data_dir)
+        # CSV をその場で書き換えてもフォルダの mtime は変わらないので、.wbk と対になる CSV は個別に確認する
+        if cached is not None and cached[0] == dir_mtime and _stamps(cached[2]) == cached[3]:
+            return list(cached[1])
+        files, watched = _prefer_compiled(glob.glob(os.path.join(data_dir, "*.csv")),
+                                          glob.glob(os.path.join(data_dir, "*" + EXTENSION)))
+        with self._lock:
+            self._listings[data_dir] = (dir_mtime, files, watched, _stamps(watched))
+        return list(files)
+
+    def get(self, path):
+        signature = _file_signature(path)
+        with self._lock:
+            book = self._books.get(path)
+            if book is not None and book.signature == signature:
+                self.hits += 1
+                return book
+            self.misses += 1
+        book = read_wordbook(path)
+        with self._lock:
+            self._books[path] = book
+        return book
+
+    def clear(self):
+        with self._lock:
+            self._books.clear()
+            self._listings.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "books": len(self._books)}
+
+
+# モジュールはプロセス内で一度だけ import されるので、再実行をまたいで共有される
+wordbook_cache = WordBookCache()